@@ -0,0 +1,310 @@
+# api/cache.py
+import os
+import sys
+import asyncio
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from . import runs
+
+CACHE_MAX_MB = float(os.getenv("SCORE_CACHE_MAX_MB", "256"))
+CACHE_TTL_S = float(os.getenv("SCORE_CACHE_TTL_S", "900"))
+TILE_CACHE_MAX_MB = float(os.getenv("TILE_CACHE_MAX_MB", "128"))
+
+def approx_size(obj: Any) -> int:
+    """Tamaño aproximado en bytes (recorrido iterativo de dict/list/str/números)."""
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, dict):
+            total += 64 + 32 * len(o)
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            total += 56 + 8 * len(o)
+            stack.extend(o)
+        elif isinstance(o, (str, bytes)):
+            total += 49 + len(o)
+        elif hasattr(o, "__dict__"):  # modelos pydantic
+            stack.append(vars(o))
+        else:
+            total += sys.getsizeof(o)
+    return total
+
+class _Flight:
+    """Cálculo en curso para una llave: los demás hilos esperan su resultado."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+class ResponseCache:
+    """
+    Caché LRU en memoria con TTL, tope de bytes y single-flight:
+    N peticiones concurrentes con la misma llave hacen un solo cálculo.
+    Las llaves incluyen el id y el refreshed_at de la corrida activa, así que
+    una corrida nueva o un refresh dejan inalcanzables las entradas viejas
+    (y `clear()` libera la memoria).
+    """
+    def __init__(self, name: str, max_bytes: int, ttl_s: float):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._aflights: Dict[Hashable, "asyncio.Future"] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _evict(self) -> None:
+        while self._data and self._bytes > self.max_bytes:
+            _, (_, size, _) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], Any],
+        sizer: Callable[[Any], int] = approx_size,
+    ) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, size, value = item
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self._bytes -= size
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = compute()
+            flight.value = value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                if flight.error is None:
+                    size = sizer(flight.value)
+                    if size <= self.max_bytes:
+                        self._data[key] = (time.monotonic() + self.ttl_s, size, flight.value)
+                        self._bytes += size
+                        self._evict()
+            flight.done.set()
+        return value
+
+    async def get_or_compute_async(
+        self,
+        key: Hashable,
+        compute: Callable[[], Awaitable[Any]],
+        sizer: Callable[[Any], int] = approx_size,
+    ) -> Any:
+        """
+        Como get_or_compute para handlers `async def`: los seguidores esperan un
+        asyncio.Future en lugar de bloquear un hilo. Los datos (y el LRU) son los
+        mismos, así que una entrada calculada por la vía síncrona también sirve.
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, size, value = item
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self._bytes -= size
+            fut = self._aflights.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                fut = self._aflights[key] = asyncio.get_running_loop().create_future()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            try:
+                # shield: si este seguidor se cancela, el futuro del líder sigue vivo
+                value = await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise
+                # Se canceló el líder (cliente desconectado): recalcula este
+                return await self.get_or_compute_async(key, compute, sizer)
+            if value is None:
+                # Líder de claim() que no guardó resultado (no cupo o no terminó)
+                return await self.get_or_compute_async(key, compute, sizer)
+            return value
+
+        try:
+            value = await compute()
+        except BaseException as e:
+            with self._lock:
+                self._aflights.pop(key, None)
+            if isinstance(e, asyncio.CancelledError):
+                fut.cancel()
+            else:
+                fut.set_exception(e)
+                fut.exception()  # marcado como recuperado si no hay seguidores
+            raise
+        with self._lock:
+            self._aflights.pop(key, None)
+            size = sizer(value)
+            if size <= self.max_bytes:
+                self._data[key] = (time.monotonic() + self.ttl_s, size, value)
+                self._bytes += size
+                self._evict()
+        fut.set_result(value)
+        return value
+
+    def claim(self, key: Hashable) -> Tuple[Any, Optional["asyncio.Future"], bool]:
+        """
+        Single-flight para productores que no caben en get_or_compute_async
+        (respuestas transmitidas). Devuelve (valor, None, False) si está en caché,
+        (None, futuro, False) si otro ya lo calcula y (None, futuro, True) si quien
+        llama es el líder: debe cerrar el vuelo con settle().
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, size, value = item
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value, None, False
+                del self._data[key]
+                self._bytes -= size
+            fut = self._aflights.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return None, fut, False
+            fut = self._aflights[key] = asyncio.get_running_loop().create_future()
+            self.misses += 1
+            return None, fut, True
+
+    def settle(self, key: Hashable, fut: "asyncio.Future", value: Any, size: int = 0) -> None:
+        """
+        Cierra el vuelo de claim(): guarda `value` (si no es None y cabe) y se lo
+        entrega a los seguidores; None les indica que calculen por su cuenta.
+        Idempotente.
+        """
+        if fut.done():
+            return
+        with self._lock:
+            if self._aflights.get(key) is fut:
+                del self._aflights[key]
+            if value is not None and size <= self.max_bytes:
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self._bytes -= old[1]
+                self._data[key] = (time.monotonic() + self.ttl_s, size, value)
+                self._bytes += size
+                self._evict()
+        fut.set_result(value)
+
+    def get(self, key: Hashable) -> Any:
+        """Valor vigente o None (sin calcular ni esperar vuelos en curso)."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "name": self.name,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+            }
+
+def normalize_params(**params: Any) -> Tuple:
+    """Llave estable: floats redondeados, bbox parseado, orden alfabético."""
+    out = []
+    for k in sorted(params):
+        v = params[k]
+        if k == "bbox" and v:
+            v = tuple(round(float(x), 6) for x in str(v).split(","))
+        elif isinstance(v, float):
+            v = round(v, 6)
+        out.append((k, v))
+    return tuple(out)
+
+def run_key(conn, endpoint: str, **params: Any) -> Tuple:
+    """
+    Llave (endpoint, corrida activa, último refresh, parámetros normalizados)
+    leída en `conn`: el valor cacheado debe calcularse en esa misma conexión
+    (con réplicas, otra podría ir atrasada) y con la corrida run_key_run(llave).
+    """
+    run_id, refreshed_at = runs.active_version(conn)
+    return (endpoint, run_id, refreshed_at, normalize_params(**params))
+
+def run_key_run(key: Tuple) -> Optional[int]:
+    """id de corrida de una llave de run_key."""
+    return key[1]
+
+def etag_for(key: Hashable) -> str:
+    """
+    ETag débil derivado de la llave (incluye el id de la corrida activa):
+    la misma respuesta puede ir con gzip, br o sin comprimir.
+    """
+    return 'W/"' + hashlib.sha1(repr(key).encode()).hexdigest()[:24] + '"'
+
+# Caché compartida por /score, /score/geojson y el chat
+score_cache = ResponseCache("score", int(CACHE_MAX_MB * 1024 * 1024), CACHE_TTL_S)
+# Tiles MVT por corrida (bytes)
+tile_cache = ResponseCache("tiles", int(TILE_CACHE_MAX_MB * 1024 * 1024), CACHE_TTL_S)
+
+def invalidate() -> None:
+    """
+    Vacía las cachés de este proceso (corrida nueva, refresh). Solo libera
+    memoria: las llaves llevan corrida y refreshed_at, así que los demás
+    workers dejan de usar sus entradas viejas sin enterarse de esta llamada.
+    """
+    score_cache.clear()
+    tile_cache.clear()
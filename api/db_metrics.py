@@ -0,0 +1,89 @@
+# api/db_metrics.py
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Sequence
+from sqlalchemy import event
+
+# Límites superiores (ms) de las cubetas de los histogramas; la última es +inf
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class Histogram:
+    """Histograma acumulativo de latencias en ms (cubetas fijas, thread-safe)."""
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.buckets, ms)] += 1
+            self._sum += ms
+            self._max = max(self._max, ms)
+
+    def _quantile(self, q: float, counts: List[int], n: int) -> float:
+        """Cota superior de la cubeta donde cae el cuantil q."""
+        target, acc = q * n, 0
+        for i, c in enumerate(counts):
+            acc += c
+            if acc >= target:
+                return self.buckets[i] if i < len(self.buckets) else self._max
+        return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self._counts)
+            n = sum(counts)
+            return {
+                "count": n,
+                "avg_ms": round(self._sum / n, 2) if n else None,
+                "max_ms": round(self._max, 2),
+                "p50_ms": self._quantile(0.5, counts, n) if n else None,
+                "p95_ms": self._quantile(0.95, counts, n) if n else None,
+                "p99_ms": self._quantile(0.99, counts, n) if n else None,
+                "buckets_ms": {("le_" + str(b)): c for b, c in zip(self.buckets, counts)} | {"inf": counts[-1]},
+            }
+
+class EngineMetrics:
+    """Estado del pool + histogramas de espera por conexión y de latencia por sentencia."""
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine  # Engine síncrono (para async: async_engine.sync_engine)
+        self.queries = Histogram()
+        self.checkout_wait = Histogram()
+        self.errors = 0
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_t0", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            stack = conn.info.get("query_t0")
+            if stack:
+                self.queries.observe((time.perf_counter() - stack.pop()) * 1000)
+
+        @event.listens_for(engine, "handle_error")
+        def _error(ctx):
+            stack = ctx.connection.info.get("query_t0") if ctx.connection is not None else None
+            if stack:
+                stack.pop()
+            self.errors += 1
+
+    def observe_wait(self, seconds: float) -> None:
+        self.checkout_wait.observe(seconds * 1000)
+
+    def snapshot(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        out: Dict[str, Any] = {"name": self.name, "url": self.engine.url.render_as_string(hide_password=True)}
+        # QueuePool expone tamaño/ocupación; otros pools (NullPool) no
+        for attr in ("size", "checkedout", "checkedin", "overflow"):
+            fn = getattr(pool, attr, None)
+            if callable(fn):
+                out[attr] = fn()
+        out["errors"] = self.errors
+        out["checkout_wait"] = self.checkout_wait.snapshot()
+        out["query_latency"] = self.queries.snapshot()
+        return out
@@ -0,0 +1,72 @@
+# api/enrich.py
+import time
+from typing import Dict, Any, Optional, List
+from sqlalchemy import text
+
+# Vértices máximos por pedazo en alcaldias_sub / flood_polygons_sub (ST_Subdivide)
+SUBDIVIDE_MAX_VERTICES = 256
+
+# ======= Tablas subdivididas =======
+def refresh_alcaldias_sub(conn) -> Dict[str, Any]:
+    """Reconstruye alcaldias_sub desde alcaldias. Usa la transacción de `conn`."""
+    t_start = time.perf_counter()
+    conn.execute(text("TRUNCATE alcaldias_sub"))
+    n = conn.execute(text("""
+        INSERT INTO alcaldias_sub (alcaldia_id, nombre, geom)
+        SELECT id, nombre, ST_Subdivide(geom, :maxv) FROM alcaldias WHERE geom IS NOT NULL
+    """), {"maxv": SUBDIVIDE_MAX_VERTICES}).rowcount or 0
+    conn.execute(text("ANALYZE alcaldias_sub"))
+    return {"pieces": n, "elapsed_s": round(time.perf_counter() - t_start, 3)}
+
+def refresh_flood_sub(conn, polygon_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Subdivide flood_polygons en flood_polygons_sub. Con `polygon_ids` solo
+    (re)hace esos polígonos (carga incremental). Usa la transacción de `conn`.
+    """
+    t_start = time.perf_counter()
+    only = "AND id = ANY(:ids)" if polygon_ids is not None else ""
+    if polygon_ids is not None:
+        conn.execute(text("DELETE FROM flood_polygons_sub WHERE polygon_id = ANY(:ids)"), {"ids": polygon_ids})
+    else:
+        conn.execute(text("TRUNCATE flood_polygons_sub"))
+    n = conn.execute(text(f"""
+        INSERT INTO flood_polygons_sub (polygon_id, geom)
+        SELECT id, ST_Subdivide(geom, :maxv) FROM flood_polygons WHERE geom IS NOT NULL {only}
+    """), {"maxv": SUBDIVIDE_MAX_VERTICES, "ids": polygon_ids}).rowcount or 0
+    conn.execute(text("ANALYZE flood_polygons_sub"))
+    return {"pieces": n, "elapsed_s": round(time.perf_counter() - t_start, 3)}
+
+# ======= Alcaldía por calle =======
+def assign_alcaldias(conn, calle_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Asigna calles.alcaldia e in_cdmx en una sola pasada set-based contra
+    alcaldias_sub: el filtro GiST descarta casi todo y la prueba exacta es barata.
+    La alcaldía es la del pedazo que contiene un punto de la calle
+    (ST_PointOnSurface); si el punto cae fuera, la primera que la toque.
+    Con `calle_ids` solo procesa esas calles. Usa la transacción de `conn`.
+    """
+    t_start = time.perf_counter()
+    only = "AND c.id = ANY(:ids)" if calle_ids is not None else ""
+    n = conn.execute(text(f"""
+        WITH m AS (
+            SELECT c.id,
+                   (SELECT s.nombre
+                    FROM alcaldias_sub s
+                    WHERE ST_Intersects(s.geom, c.geom)
+                    ORDER BY ST_Intersects(s.geom, ST_PointOnSurface(c.geom)) DESC
+                    LIMIT 1) AS nombre
+            FROM calles c
+            WHERE c.geom IS NOT NULL {only}
+        )
+        UPDATE calles c
+        SET alcaldia = m.nombre, in_cdmx = m.nombre IS NOT NULL
+        FROM m
+        WHERE c.id = m.id
+          AND (c.alcaldia IS DISTINCT FROM m.nombre OR c.in_cdmx <> (m.nombre IS NOT NULL))
+    """), {"ids": calle_ids}).rowcount or 0
+
+    return {
+        "mode": "full" if calle_ids is None else "calles",
+        "updated": n,
+        "elapsed_s": round(time.perf_counter() - t_start, 3),
+    }
@@ -0,0 +1,77 @@
+# api/grids.py
+import time
+from typing import Dict, Any, Optional
+from sqlalchemy import text
+
+# Tolerancia máxima (m) que se guarda en street_cells (igual al tope de /score)
+MAX_TOL_M = 50.0
+# Margen en grados para candidatas: 50 m ≈ 0.00048° de longitud a 19.5°N
+PAD_DEG = 0.0005
+
+def cell_index(ix: int, iy: int, nx: int) -> int:
+    """Índice lineal de la celda (fila iy, columna ix) en una rejilla de nx columnas."""
+    return iy * nx + ix
+
+def ensure_grid(conn, minx: float, miny: float, step_deg: float, nx: int, ny: int) -> Dict[str, Any]:
+    """
+    Registra (o recupera) la especificación de rejilla regular.
+    minx/miny son el centroide de la celda (0, 0); cada celda es centroide ± step/2.
+    """
+    row = conn.execute(text("""
+        INSERT INTO forecast_grids (minx, miny, step_deg, nx, ny)
+        VALUES (:minx, :miny, :step, :nx, :ny)
+        ON CONFLICT (minx, miny, step_deg, nx, ny) DO UPDATE SET minx = EXCLUDED.minx
+        RETURNING id, built_at
+    """), {"minx": minx, "miny": miny, "step": step_deg, "nx": nx, "ny": ny}).mappings().one()
+    return dict(row)
+
+def build_street_cells(conn, grid_id: int, calle_ids: Optional[list] = None) -> Dict[str, Any]:
+    """
+    Calcula para cada calle las celdas de la rejilla que toca su bbox ampliado
+    MAX_TOL_M (aritmética sobre ST_XMin/ST_XMax/..., sin join espacial), su
+    distancia en metros (UTM 14N) y la fracción de la calle dentro de cada celda.
+    Con `calle_ids` solo rehace esas calles.
+    """
+    t_start = time.perf_counter()
+    only = "AND c.id = ANY(:ids)" if calle_ids is not None else ""
+    params = {"g": grid_id, "max_tol": MAX_TOL_M, "pad": PAD_DEG, "ids": calle_ids}
+
+    if calle_ids is not None:
+        conn.execute(text("DELETE FROM street_cells WHERE grid_id = :g AND calle_id = ANY(:ids)"), params)
+    else:
+        conn.execute(text("DELETE FROM street_cells WHERE grid_id = :g"), params)
+
+    n = conn.execute(text(f"""
+        WITH g AS (
+            SELECT id, minx - step_deg/2 AS x0, miny - step_deg/2 AS y0, step_deg AS s, nx, ny
+            FROM forecast_grids WHERE id = :g
+        ),
+        cand AS (
+            SELECT c.id AS calle_id, c.geom, c.geom_m, g.*, ix, iy
+            FROM calles c, g,
+                 generate_series(GREATEST(0, floor((ST_XMin(c.geom) - :pad - g.x0) / g.s)::int),
+                                 LEAST(g.nx - 1, floor((ST_XMax(c.geom) + :pad - g.x0) / g.s)::int)) AS ix,
+                 generate_series(GREATEST(0, floor((ST_YMin(c.geom) - :pad - g.y0) / g.s)::int),
+                                 LEAST(g.ny - 1, floor((ST_YMax(c.geom) + :pad - g.y0) / g.s)::int)) AS iy
+            WHERE c.geom IS NOT NULL {only}
+        ),
+        cells AS (
+            SELECT calle_id, geom, geom_m, iy * nx + ix AS cell_idx,
+                   ST_MakeEnvelope(x0 + ix*s, y0 + iy*s, x0 + (ix+1)*s, y0 + (iy+1)*s, 4326) AS cell
+            FROM cand
+        ),
+        d AS (
+            SELECT calle_id, cell_idx,
+                   ST_Distance(geom_m, ST_Transform(cell, 32614)) AS dist_m,
+                   COALESCE(ST_Length(ST_Intersection(geom, cell)) / NULLIF(ST_Length(geom), 0), 0) AS frac
+            FROM cells
+        )
+        INSERT INTO street_cells (grid_id, calle_id, cell_idx, dist_m, overlap_frac)
+        SELECT :g, calle_id, cell_idx, dist_m, frac
+        FROM d
+        WHERE dist_m <= :max_tol
+    """), params).rowcount or 0
+
+    if calle_ids is None:
+        conn.execute(text("UPDATE forecast_grids SET built_at = (now() AT TIME ZONE 'utc') WHERE id = :g"), params)
+    return {"grid_id": grid_id, "rows": n, "elapsed_s": round(time.perf_counter() - t_start, 3)}
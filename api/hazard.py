@@ -0,0 +1,71 @@
+# api/hazard.py
+import time
+from typing import Dict, Any, Optional, List
+from sqlalchemy import text
+from .scoring import SCORE_TOLERANCES
+
+def refresh_street_hazard(
+    conn,
+    polygon_ids: Optional[List[int]] = None,
+    calle_ids: Optional[List[int]] = None,
+    tolerances=SCORE_TOLERANCES,
+) -> Dict[str, Any]:
+    """
+    Precalcula street_hazard: por calle y tolerancia, si toca algún polígono de
+    flood_polygons (mismo criterio que scoring: ST_DWithin en metros sobre geom_m)
+    y qué fracción de su longitud cae dentro de polígonos. Cruza contra
+    flood_polygons_sub (ver enrich.refresh_flood_sub), que debe estar al día.
+    - polygon_ids: solo recalcula las calles cercanas a esos polígonos (carga incremental).
+    - calle_ids: solo recalcula esas calles.
+    - ninguno: reconstruye la tabla completa.
+    Solo guarda filas con hazard (tabla dispersa). Usa la transacción de `conn`.
+    """
+    t_start = time.perf_counter()
+    max_tol = max(tolerances)
+    params: Dict[str, Any] = {"max_tol": max_tol, "pids": polygon_ids, "cids": calle_ids}
+
+    if polygon_ids is not None:
+        # Calles afectadas por los polígonos nuevos (a la tolerancia máxima)
+        target = """
+            SELECT DISTINCT c.id AS id FROM calles c
+            JOIN flood_polygons_sub f ON ST_DWithin(c.geom_m, f.geom_m, :max_tol)
+            WHERE f.polygon_id = ANY(:pids)
+        """
+    elif calle_ids is not None:
+        target = "SELECT unnest(CAST(:cids AS int[])) AS id"
+    else:
+        target = None
+
+    if target is None:
+        conn.execute(text("TRUNCATE street_hazard"))
+        scope = ""
+    else:
+        conn.execute(text("DROP TABLE IF EXISTS hazard_target"))
+        conn.execute(text(f"CREATE TEMP TABLE hazard_target ON COMMIT DROP AS {target}"), params)
+        conn.execute(text("DELETE FROM street_hazard WHERE calle_id IN (SELECT id FROM hazard_target)"))
+        scope = "AND c.id IN (SELECT id FROM hazard_target)"
+
+    n = 0
+    for tol in tolerances:
+        near = (
+            "ST_DWithin(c.geom_m, f.geom_m, :tol_m)"
+            if tol > 0 else "ST_Intersects(c.geom, f.geom)"
+        )
+        n += conn.execute(text(f"""
+            INSERT INTO street_hazard (calle_id, tol_m, hazard, frac)
+            SELECT
+                c.id, :tol_m, 1.0,
+                COALESCE(
+                    ST_Length(ST_Intersection(c.geom, ST_Union(f.geom))) / NULLIF(ST_Length(c.geom), 0),
+                    0)
+            FROM calles c
+            JOIN flood_polygons_sub f ON {near}
+            WHERE 1=1 {scope}
+            GROUP BY c.id, c.geom
+        """), {**params, "tol_m": float(tol)}).rowcount or 0
+
+    return {
+        "mode": "full" if target is None else ("polygons" if polygon_ids is not None else "calles"),
+        "rows": n,
+        "elapsed_s": round(time.perf_counter() - t_start, 3),
+    }
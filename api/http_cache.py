@@ -0,0 +1,209 @@
+# api/http_cache.py
+import json
+import asyncio
+import zlib
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from .db import run_read, read_replica
+from . import runs
+from .cache import ResponseCache, normalize_params, etag_for
+
+try:  # brotli es opcional: sin el paquete solo se ofrece gzip
+    import brotli
+except ImportError:
+    brotli = None
+
+# Nivel de compresión (rápido; el resultado se cachea por corrida)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Respuestas transmitidas más grandes que esto no se guardan en caché
+STREAM_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# ======= Codificación =======
+def pick_encoding(accept_encoding: str) -> str:
+    """br si el cliente lo acepta y brotli está instalado; si no gzip; si no identity."""
+    offered = {p.split(";")[0].strip().lower() for p in (accept_encoding or "").split(",")}
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return "identity"
+
+class Compressor:
+    """Compresión incremental (para respuestas transmitidas por partes)."""
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._c = None
+
+    def compress(self, data: bytes) -> bytes:
+        if self._c is None:
+            return data
+        return self._c.process(data) if self.encoding == "br" else self._c.compress(data)
+
+    def flush(self) -> bytes:
+        if self._c is None:
+            return b""
+        return self._c.finish() if self.encoding == "br" else self._c.flush()
+
+def encode(body: bytes, encoding: str) -> bytes:
+    c = Compressor(encoding)
+    return c.compress(body) + c.flush()
+
+def json_bytes(obj: Any) -> bytes:
+    return json.dumps(jsonable_encoder(obj), ensure_ascii=False, separators=(",", ":")).encode()
+
+# ======= Validación condicional =======
+class Snapshot(NamedTuple):
+    """Corrida con la que revalidate armó llave y ETag, y la réplica donde la leyó."""
+    run: Dict[str, Any]
+    replica: int
+
+    @property
+    def run_id(self) -> Optional[int]:
+        return self.run.get("id")
+
+    async def read(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """run_read fijo a la misma réplica: no ve una versión más vieja que la de la llave."""
+        return await run_read(fn, *args, replica=self.replica, **kwargs)
+
+async def revalidate(
+    request: Request,
+    endpoint: str,
+    cache_control: str = "no-cache",
+    **params: Any,
+) -> Tuple[Hashable, Dict[str, str], Optional[Response], Snapshot]:
+    """
+    Llave de la respuesta (endpoint, corrida activa, último refresh, parámetros
+    normalizados), sus encabezados ETag/Last-Modified, la respuesta 304 lista si
+    el cliente ya la tiene (If-None-Match / If-Modified-Since) y el Snapshot
+    con el que se debe leer el cuerpo: misma réplica y corrida explícita
+    (run_id), para no cachear bajo esta llave datos de otra corrida.
+    Todo sale de forecast_runs, así que cualquier worker da la misma respuesta.
+    """
+    replica = read_replica()
+    run = await run_read(runs.active_run, replica=replica) or {}
+    snap = Snapshot(run, replica)
+    key = (endpoint, run.get("id"), run.get("refreshed_at"), normalize_params(**params))
+    etag = etag_for(key)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    stamps = [t for t in (run.get("activated_at"), run.get("refreshed_at")) if t is not None]
+    modified = max(stamps).replace(tzinfo=timezone.utc, microsecond=0) if stamps else None
+    if modified is not None:
+        headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+
+    inm = request.headers.get("if-none-match")
+    ims = request.headers.get("if-modified-since")
+    fresh = False
+    if inm:
+        # Comparación débil: W/"x" y "x" son la misma representación
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        fresh = "*" in tags or etag.removeprefix("W/") in tags
+    elif ims and modified is not None:
+        try:
+            fresh = modified <= parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            fresh = False
+    return key, headers, Response(status_code=304, headers=headers) if fresh else None, snap
+
+# ======= Respuestas con bytes codificados en caché =======
+async def encoded_response(
+    request: Request,
+    key: Hashable,
+    headers: Dict[str, str],
+    compute: Callable[[], Awaitable[bytes]],
+    cache: ResponseCache,
+    media_type: str = "application/json",
+) -> Response:
+    """
+    Respuesta con el cuerpo ya codificado (gzip/br/identity) guardado en `cache`
+    por (key, codificación): un acierto no toca la base ni vuelve a comprimir.
+    La compresión corre en el threadpool para no frenar el event loop.
+    """
+    enc = pick_encoding(request.headers.get("accept-encoding", ""))
+
+    async def build() -> bytes:
+        return await run_in_threadpool(encode, await compute(), enc)
+
+    body = await cache.get_or_compute_async(key + (enc,), build, sizer=len)
+    if enc != "identity":
+        headers = {**headers, "Content-Encoding": enc}
+    return Response(content=body, media_type=media_type, headers=headers)
+
+async def _compressed(chunks: Callable[[], AsyncIterator[bytes]], enc: str) -> AsyncIterator[bytes]:
+    comp = Compressor(enc)
+    async for chunk in chunks():
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+class _LeaderStreamingResponse(StreamingResponse):
+    """StreamingResponse que siempre cierra el vuelo del líder, aunque el cuerpo no llegue a iterarse."""
+    def __init__(self, content: AsyncIterator[bytes], release: Callable[[], None], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+async def streamed_response(
+    request: Request,
+    key: Hashable,
+    headers: Dict[str, str],
+    chunks: Callable[[], AsyncIterator[bytes]],
+    cache: ResponseCache,
+    media_type: str = "application/json",
+) -> Response:
+    """
+    Como encoded_response, pero si no está en caché transmite `chunks()`
+    comprimiendo al vuelo y guarda el resultado codificado al terminar
+    (si no excede STREAM_CACHE_MAX_BYTES). Single-flight por (key, codificación):
+    las peticiones concurrentes esperan los bytes del líder y solo transmiten
+    por su cuenta si el cuerpo no cupo en caché o el líder no terminó.
+    """
+    enc = pick_encoding(request.headers.get("accept-encoding", ""))
+    if enc != "identity":
+        headers = {**headers, "Content-Encoding": enc}
+    ckey = key + (enc,)
+    cached, fut, leader = cache.claim(ckey)
+    if cached is None and not leader:
+        # shield: si este seguidor se cancela, el vuelo del líder sigue
+        try:
+            cached = await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if not fut.cancelled():
+                raise
+        except Exception:
+            pass  # falló el líder (p. ej. el modo sin stream): se transmite sin caché
+    if cached is not None:
+        return Response(content=cached, media_type=media_type, headers=headers)
+    if not leader:
+        return StreamingResponse(_compressed(chunks, enc), media_type=media_type, headers=headers)
+
+    result: Dict[str, Any] = {"body": None, "size": 0}
+
+    async def body() -> AsyncIterator[bytes]:
+        parts, size = [], 0
+        async for out in _compressed(chunks, enc):
+            size += len(out)
+            if size <= STREAM_CACHE_MAX_BYTES:
+                parts.append(out)
+            yield out
+        if size <= STREAM_CACHE_MAX_BYTES:
+            result.update(body=b"".join(parts), size=size)
+
+    return _LeaderStreamingResponse(body(), lambda: cache.settle(ckey, fut, result["body"], result["size"]),
+                                    media_type=media_type, headers=headers)
@@ -0,0 +1,75 @@
+# api/ingest.py
+import time
+from typing import Iterable, Tuple, Dict, Any, List, Optional
+from datetime import datetime
+from sqlalchemy import text
+
+# (ts, mm, mm_cum, peak_cum, cell_idx, geom) -- geom como texto GeoJSON o WKT según `geom_format`.
+# mm_cum=None guarda la celda como serie de un solo valor (ARRAY[mm]); cell_idx=None fuera de rejilla.
+CellRow = Tuple[datetime, float, Optional[List[float]], Optional[List[float]], Optional[int], str]
+
+_GEOM_PARSERS = {
+    "geojson": "ST_GeomFromGeoJSON(geom_txt)",
+    "wkt": "ST_GeomFromText(geom_txt)",
+}
+
+def cell_wkt(lon: float, lat: float, half: float) -> str:
+    """Polígono WKT cuadrado alrededor del centroide (± half)."""
+    x0, x1, y0, y1 = lon - half, lon + half, lat - half, lat + half
+    return f"POLYGON(({x0} {y0},{x1} {y0},{x1} {y1},{x0} {y1},{x0} {y0}))"
+
+def prefix_series(hourly: List[float]) -> Tuple[List[float], List[float]]:
+    """Sumas prefijas y máximos prefijos de una serie horaria (None cuenta como 0)."""
+    cum, peak = [], []
+    acc, top = 0.0, 0.0
+    for v in hourly:
+        v = float(v or 0.0)
+        acc += v
+        top = max(top, v)
+        cum.append(round(acc, 3))
+        peak.append(top)
+    return cum, peak
+
+def copy_forecast_cells(conn, run_id: int, rows: Iterable[CellRow], geom_format: str = "geojson") -> Dict[str, Any]:
+    """
+    Carga masiva de celdas de la corrida `run_id`: COPY a una tabla temporal de
+    staging y un solo INSERT ... SELECT hacia precip_forecast. Corre en la transacción de `conn`
+    (Connection de SQLAlchemy sobre psycopg 3). Devuelve filas y filas/seg.
+    """
+    if geom_format not in _GEOM_PARSERS:
+        raise ValueError(f"geom_format inválido: {geom_format}")
+    t_start = time.perf_counter()
+
+    conn.execute(text("""
+        CREATE TEMP TABLE IF NOT EXISTS precip_stage (
+            ts TIMESTAMP, mm DOUBLE PRECISION, mm_cum REAL[], peak_cum REAL[], cell_idx INT, geom_txt TEXT
+        ) ON COMMIT DELETE ROWS
+    """))
+    conn.execute(text("TRUNCATE precip_stage"))
+
+    raw = conn.connection.driver_connection  # psycopg.Connection (misma transacción)
+    staged = 0
+    with raw.cursor() as cur:
+        with cur.copy("COPY precip_stage (ts, mm, mm_cum, peak_cum, cell_idx, geom_txt) FROM STDIN") as cp:
+            cp.set_types(["timestamp", "float8", "float4[]", "float4[]", "int4", "text"])
+            for row in rows:
+                cp.write_row(row)
+                staged += 1
+    t_copy = time.perf_counter()
+
+    inserted = conn.execute(text(f"""
+        INSERT INTO precip_forecast (run_id, ts, mm, mm_cum, peak_cum, cell_idx, geom)
+        SELECT :run_id, ts, mm, COALESCE(mm_cum, ARRAY[mm]::real[]), peak_cum, cell_idx,
+               ST_SetSRID({_GEOM_PARSERS[geom_format]}, 4326)
+        FROM precip_stage
+    """), {"run_id": run_id}).rowcount or 0
+    t_end = time.perf_counter()
+
+    elapsed = t_end - t_start
+    return {
+        "rows": inserted,
+        "copy_s": round(t_copy - t_start, 3),
+        "insert_s": round(t_end - t_copy, 3),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(inserted / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -1,6 +1,11 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeout
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import system, forecast, score, chat
+from fastapi.middleware.gzip import GZipMiddleware
+from .routers import system, forecast, score, chat, streets
+from . import scheduler
+from .db import is_timeout
 
 app = FastAPI(title="CDMX Flood API", version="0.1.0")
 
@@ -11,34 +16,40 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# gzip para el resto de respuestas grandes; /score* ya llegan codificadas
+# (Content-Encoding puesto) y el middleware las deja pasar
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Sentencia cancelada por statement_timeout o pool sin conexiones libres: 503
+# (el cliente puede reintentar); otros errores de base siguen siendo 500
+@app.exception_handler(DBAPIError)
+@app.exception_handler(PoolTimeout)
+async def db_error_handler(request: Request, exc: Exception):
+    if is_timeout(exc):
+        return JSONResponse(status_code=503, headers={"Retry-After": "5"},
+                            content={"detail": "la base de datos tardó demasiado; intenta de nuevo"})
+    print(f"[db] {request.url.path}: {exc!r}")
+    return JSONResponse(status_code=500, content={"detail": "error de base de datos"})
 
 app.include_router(system.router)
 app.include_router(forecast.router)
 app.include_router(score.router)
 app.include_router(chat.router)
+app.include_router(streets.router)
 
 @app.get("/")
 def root():
     return {"msg": "CDMX Flood API lista", "docs": "/docs"}
 
-# ======= Carga automática al arranque =======
+# ======= Refresco de pronóstico en segundo plano =======
 @app.on_event("startup")
-def prime_openmeteo_on_startup():
+def start_forecast_scheduler():
     """
-    Carga pronóstico 72h de Open-Meteo para CDMX al iniciar el servidor.
-    Si ya hay datos de una corrida previa en esa ventana, se limpian.
+    Lanza el ciclo de carga de Open-Meteo (api/scheduler.py) en un hilo: el
+    servidor acepta tráfico de inmediato y /system/ready dice cuándo hay corrida.
     """
-    try:
-        from .routers.forecast import OpenMeteoReq, load_openmeteo
-        req = OpenMeteoReq(
-            bbox="-99.36,19.18,-98.94,19.59",  # CDMX aprox
-            step_deg=0.06,                      # rejilla ligera (~6 km)
-            hours=72,
-            clear_previous=True
-        )
-        # Llamada síncrona; el server terminará de levantar tras cargar
-        load_openmeteo(req)
-        print("[startup] Open-Meteo cargado correctamente.")
-    except Exception as e:
-        # No reventamos el arranque si falla la carga
-        print(f"[startup] Open-Meteo falló: {e!r}")
+    scheduler.start()
+
+@app.on_event("shutdown")
+def stop_forecast_scheduler():
+    scheduler.stop()
@@ -0,0 +1,40 @@
+# api/network.py
+import time
+from typing import Dict, Any, List
+from sqlalchemy import text
+from . import grids, hazard, scoring, enrich, runs
+
+# Change set de la red vial (ids de calles), como lo emite tools/load_osm_roads.py:
+#   added:    calles nuevas
+#   modified: calles cuya geometría cambió
+#   renamed:  solo cambió nombre/highway (no afecta tablas derivadas)
+#   removed:  calles borradas (sus filas derivadas se fueron por ON DELETE CASCADE)
+ChangeSet = Dict[str, List[int]]
+
+def empty_changes() -> ChangeSet:
+    return {"added": [], "modified": [], "renamed": [], "removed": []}
+
+def apply_changes(conn, changes: ChangeSet) -> Dict[str, Any]:
+    """
+    Aplica un change set a las tablas derivadas solo para las calles tocadas:
+    alcaldía/in_cdmx, street_cells de cada rejilla construida, street_hazard y
+    street_scores de la corrida activa, en ese orden (scores lee celdas y hazard).
+    Si el change set trae cualquier cambio (también solo renombres o bajas)
+    sella refreshed_at. Usa la transacción de `conn`.
+    """
+    t_start = time.perf_counter()
+    ids = sorted(set(changes.get("added", [])) | set(changes.get("modified", [])))
+    out: Dict[str, Any] = {"calles": len(ids), "removed": len(changes.get("removed", []))}
+
+    if ids:
+        out["alcaldias"] = enrich.assign_alcaldias(conn, calle_ids=ids)
+        grid_ids = conn.execute(text("SELECT id FROM forecast_grids WHERE built_at IS NOT NULL")).scalars().all()
+        out["street_cells"] = [grids.build_street_cells(conn, g, calle_ids=ids) for g in grid_ids]
+        out["street_hazard"] = hazard.refresh_street_hazard(conn, calle_ids=ids)
+        out["street_scores"] = scoring.refresh_street_scores(conn, calle_ids=ids)
+    # Renombres y bajas no tocan derivadas pero sí cambian las respuestas:
+    # la API revalida caché/ETag con este sello (ver runs.active_version)
+    if any(changes.get(k) for k in ("added", "modified", "renamed", "removed")):
+        runs.mark_refreshed(conn)
+    out["elapsed_s"] = round(time.perf_counter() - t_start, 3)
+    return out
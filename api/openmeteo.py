@@ -0,0 +1,132 @@
+# api/openmeteo.py
+import os
+import time
+import random
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional, Tuple
+
+# URL configurable para poder apuntar a un stub local en pruebas
+OPENMETEO_URL = os.getenv("OPENMETEO_URL", "https://api.open-meteo.com/v1/forecast")
+CONCURRENCY = int(os.getenv("OPENMETEO_CONCURRENCY", "16"))
+TIMEOUT_S = float(os.getenv("OPENMETEO_TIMEOUT_S", "15"))
+CELL_BUDGET_S = float(os.getenv("OPENMETEO_CELL_BUDGET_S", "30"))
+RETRIES = int(os.getenv("OPENMETEO_RETRIES", "3"))
+BACKOFF_S = float(os.getenv("OPENMETEO_BACKOFF_S", "0.5"))
+# Coordenadas por petición (Open-Meteo acepta listas separadas por coma)
+BATCH_SIZE = int(os.getenv("OPENMETEO_BATCH_SIZE", "100"))
+
+# Códigos que vale la pena reintentar (rate limit / fallas del upstream)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+Point = Tuple[float, float]  # (lat, lon)
+
+def make_session(pool_size: int) -> requests.Session:
+    """Sesión keep-alive con pool del tamaño de la concurrencia."""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+def _get_json(
+    session: requests.Session,
+    url: str,
+    params: Dict[str, Any],
+    timeout_s: float,
+    budget_s: float,
+    retries: int,
+    backoff_s: float,
+) -> Any:
+    """
+    GET con reintentos y backoff exponencial (+jitter).
+    `budget_s` limita el tiempo total de la petición (celda o lote), sumando todos los intentos.
+    """
+    deadline = time.monotonic() + budget_s
+    last_err: Optional[Exception] = None
+    for attempt in range(retries + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            r = session.get(url, params=params, timeout=min(timeout_s, remaining))
+            if r.status_code in RETRY_STATUS:
+                raise requests.HTTPError(f"HTTP {r.status_code}", response=r)
+            r.raise_for_status()
+            return r.json()
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            last_err = e
+            resp = getattr(e, "response", None)
+            if resp is not None and resp.status_code not in RETRY_STATUS:
+                break  # 4xx definitivo: no reintentar
+        if attempt < retries:
+            pause = backoff_s * (2 ** attempt) * (1 + random.random() * 0.25)
+            time.sleep(max(0.0, min(pause, deadline - time.monotonic())))
+    raise last_err or requests.Timeout(f"sin tiempo para {params}")
+
+def chunks(items: List[Point], n: int) -> List[List[Point]]:
+    n = max(1, n)
+    return [items[i:i + n] for i in range(0, len(items), n)]
+
+def fetch_grid(
+    points: List[Point],
+    hourly: str = "precipitation",
+    forecast_days: int = 7,
+    base_url: Optional[str] = None,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = CONCURRENCY,
+    timeout_s: float = TIMEOUT_S,
+    cell_budget_s: float = CELL_BUDGET_S,
+    retries: int = RETRIES,
+    backoff_s: float = BACKOFF_S,
+) -> Tuple[Dict[Point, Any], Dict[str, Any]]:
+    """
+    Descarga el pronóstico horario de todos los puntos en paralelo
+    (pool de hilos + sesión compartida). Con batch_size > 1 cada petición lleva
+    varias coordenadas y la respuesta (lista) se mapea de vuelta por posición.
+    Devuelve ({(lat, lon): json}, stats). Los lotes que fallan tras los
+    reintentos se omiten y sus puntos se cuentan en stats.
+    """
+    url = base_url or OPENMETEO_URL
+    batches = chunks(points, batch_size)
+    workers = max(1, min(concurrency, len(batches) or 1))
+    results: Dict[Point, Any] = {}
+    failed = 0
+    t_start = time.monotonic()
+
+    def one(batch: List[Point]):
+        params = {
+            "latitude": ",".join(str(lat) for lat, _ in batch),
+            "longitude": ",".join(str(lon) for _, lon in batch),
+            "hourly": hourly,
+            "forecast_days": forecast_days,
+            "timezone": "UTC",
+        }
+        data = _get_json(session, url, params, timeout_s, cell_budget_s, retries, backoff_s)
+        # Una coordenada -> objeto; varias -> lista en el mismo orden
+        items = data if isinstance(data, list) else [data]
+        if len(items) != len(batch):
+            raise ValueError(f"respuesta con {len(items)} resultados para {len(batch)} coordenadas")
+        return items
+
+    with make_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(one, b) for b in batches]
+        for fut, batch in zip(futures, batches):
+            try:
+                for pt, data in zip(batch, fut.result()):
+                    results[pt] = data
+            except Exception as e:
+                print(f"Open-Meteo fallo en lote {batch[0][0]},{batch[0][1]} (+{len(batch) - 1}): {e}")
+                failed += len(batch)
+
+    stats = {
+        "requested": len(points),
+        "ok": len(results),
+        "failed": failed,
+        "http_calls": len(batches),
+        "batch_size": batch_size,
+        "concurrency": workers,
+        "elapsed_s": round(time.monotonic() - t_start, 3),
+    }
+    return results, stats
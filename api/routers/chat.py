@@ -4,13 +4,16 @@ import re
 import json
 import requests
 import unicodedata
+from datetime import timedelta
 from typing import Optional, List, Dict, Any
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from ..db import connect
+from .. import scoring, runs, streets
+from ..cache import score_cache, run_key, run_key_run
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-API_BASE = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OR_SITE = os.getenv("OPENROUTER_SITE_URL", "http://localhost:8000")
 OR_APP  = os.getenv("OPENROUTER_APP_NAME", "CDMX Flood")
@@ -22,11 +25,28 @@ class ChatReq(BaseModel):
     q: Optional[str] = None  # compat
 
 # ==================== Utils ====================
-def _http_get(path: str, params: Dict[str, Any]) -> Any:
-    url = f"{API_BASE.rstrip('/')}/{path.lstrip('/')}"
-    r = requests.get(url, params=params, timeout=60)
-    r.raise_for_status()
-    return r.json()
+# Parámetros de score que usa el chat (mismos que antes pedía a /score)
+_SCORE_OPTS = {"hours": 72, "tolerance_m": 5, "use_hazard": True, "min_mm": 0.0,
+               "only_cdmx": True, "mm_ref": 80}
+
+def _scores(**filters) -> List[Dict[str, Any]]:
+    """Ranking de calles en proceso (servicio de scoring), filtros empujados a SQL."""
+    with connect("read") as conn:
+        return scoring.score_rows(conn, **{**_SCORE_OPTS, **filters})
+
+def _alcaldias() -> List[Dict[str, Any]]:
+    """Estadísticas por alcaldía (dict cacheado por corrida; /score/alcaldias cachea sus bytes aparte)."""
+    query = {**_SCORE_OPTS, "weighted": False, "min_rows": 1}
+    with connect("read") as conn:
+        key = run_key(conn, "alcaldias", **query)
+        summary = score_cache.get_or_compute(
+            key, lambda: scoring.alcaldia_summary(conn, run_id=run_key_run(key), **query))
+    return summary["alcaldias"]
+
+def _alcaldia_stats(alc: str) -> Dict[str, Any]:
+    """Fila de _alcaldias() cuyo nombre contiene `alc` (sin acentos); {} si no hay."""
+    a = _norm(alc)
+    return next((r for r in _alcaldias() if a in _norm(r.get("alcaldia") or "")), {})
 
 def _strip_accents(s: str) -> str:
     if not s:
@@ -87,28 +107,17 @@ def _alcaldia_alias(s: str) -> str:
         "cuajimalpa": "Cuajimalpa de Morelos", "cuajimalpa de morelos": "Cuajimalpa de Morelos",
         "la magdalena contreras": "La Magdalena Contreras",
     }
-    return alias.get(n, _clean_name(s))
+    # Nombre oficial (tabla alcaldias) más parecido: calles.alcaldia se filtra por igualdad
+    try:
+        with connect("read") as conn:
+            return streets.match_alcaldia(conn, alias.get(n, n)) or alias.get(n) or _clean_name(s)
+    except Exception:
+        return alias.get(n, _clean_name(s))
 
-def _best_match_streets(term: str, rows: List[Dict[str, Any]], alcaldia: Optional[str]=None, maxn: int=10):
-    t = _norm(term)
-    if not t:
-        return []
-    cand = []
-    for r in rows:
-        nombre = _norm(r.get("nombre") or r.get("calle") or "")
-        alc    = _norm(r.get("alcaldia") or "")
-        if t in nombre and (alcaldia is None or _norm(alcaldia) in alc):
-            cand.append(r)
-    if not cand and len(t) >= 4:
-        toks = [w for w in t.split() if len(w) >= 4]
-        for r in rows:
-            nombre = _norm(r.get("nombre") or r.get("calle") or "")
-            alc    = _norm(r.get("alcaldia") or "")
-            if all(w in nombre for w in toks) and (alcaldia is None or _norm(alcaldia) in alc):
-                cand.append(r)
-    cand = _dedup(cand)
-    cand.sort(key=lambda x: float(x.get("score") or 0.0), reverse=True)
-    return cand[:maxn]
+def _best_match_streets(term: str, alcaldia: Optional[str]=None, maxn: int=10):
+    """Búsqueda difusa de calles (api/streets.py) con su score actual."""
+    with connect("read") as conn:
+        return streets.search(conn, term, alcaldia=alcaldia, limit=maxn, **_SCORE_OPTS)
 
 # ==================== IA helpers ====================
 def _sanitize_ai(text: str, max_chars: int = 1400) -> str:
@@ -148,11 +157,12 @@ def _llm_with_facts(task: str, facts: Dict[str, Any], fallback_text: str) -> str
         "NO agregues fechas, lugares o nombres que no aparezcan literalmente en FACTS. "
         "Si algún dato no está, di 'no disponible'. Sé breve y directo."
     )
-    user = (
-        f"TAREA: {task}\n\nFACTS (JSON):\n{json.dumps(facts, ensure_ascii=False)}\n\n"
-        "Estilo: 1–3 párrafos cortos o viñetas; usa mm cuando aplique; sin fuentes genéricas."
-    )
     try:
+        # default=float para Decimal (numeric); otro tipo no serializable cae al fallback
+        user = (
+            f"TAREA: {task}\n\nFACTS (JSON):\n{json.dumps(facts, ensure_ascii=False, default=float)}\n\n"
+            "Estilo: 1–3 párrafos cortos o viñetas; usa mm cuando aplique; sin fuentes genéricas."
+        )
         rr = requests.post(
             "https://openrouter.ai/api/v1/chat/completions",
             headers=headers,
@@ -274,22 +284,22 @@ def chat(req: ChatReq):
     # 1) Resumen 72h
     if _re_resumen.search(msg_nop):
         try:
-            summ = _http_get("forecast/summary", {"from_hours": 0, "to_hours": 72})
+            with connect("read") as conn:
+                summ = scoring.forecast_summary(conn, 0, 72)
+                run = runs.active_run(conn) or {}
         except Exception as e:
             return {"answer": f"⚠️ No pude leer el resumen 72h: {e}"}
         try:
-            sc = _http_get("score", {
-                "hours": 72, "top_k": 800, "tolerance_m": 5,
-                "use_hazard": True, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-            })
-            filas = sc.get("rows", [])
+            filas = _scores(top_k=10, distinct=True)
         except Exception:
             filas = []
+        t0 = run.get("series_start")
         facts = {
-            "ventana_utc": summ.get("window_utc", {}),
+            "ventana_utc": ({"from": t0.isoformat(), "to": (t0 + timedelta(hours=72)).isoformat()}
+                            if t0 else {}),
             "n_celdas": int(summ.get("n_cells", 0)),
             "lluvia_total_mm": float(summ.get("mm_sum", 0.0)),
-            "top_calles": filas[:10],
+            "top_calles": filas,
         }
         fallback = (f"Resumen 72h: lluvia total {facts['lluvia_total_mm']:.1f} mm, "
                     f"celdas={facts['n_celdas']}. Top calles:\n{_fmt_list(facts['top_calles'], 10)}")
@@ -301,22 +311,13 @@ def chat(req: ChatReq):
         nivel = (m.group(2) or "").lower()
         alc   = _alcaldia_alias(m.group(4) or "")
         try:
-            sc = _http_get("score", {
-                "hours": 72, "top_k": 5000, "tolerance_m": 5,
-                "use_hazard": True, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-            })
-            filas = sc.get("rows", [])
+            sel = _scores(alcaldia=alc, nivel=nivel, top_k=15, distinct=True)
+            st = _alcaldia_stats(alc)
         except Exception as e:
             return {"answer": f"⚠️ No pude leer score: {e}"}
 
-        sel = [r for r in filas
-               if _norm(r.get("alcaldia") or "").find(_norm(alc)) >= 0
-               and _norm(r.get("nivel") or "") == _norm(nivel)]
-
         if not sel:
-            cand = [r for r in filas if _norm(r.get("alcaldia") or "").find(_norm(alc)) >= 0]
-            cand.sort(key=lambda r: float(r.get("score") or 0.0), reverse=True)
-            cand = cand[:15]
+            cand = _scores(alcaldia=alc, top_k=15, distinct=True)
             if cand:
                 txt = (f"No encontré tramos con nivel {nivel} en {alc}.\n"
                        f"Estas son las calles con mayor score ahora mismo en {alc}:\n{_fmt_list(cand, 15)}")
@@ -324,7 +325,8 @@ def chat(req: ChatReq):
             else:
                 return {"answer": f"No tengo tramos para {alc} en este momento."}
 
-        facts = {"alcaldia": alc, "nivel": nivel, "total_tramos": len(sel), "ejemplos": sel[:15]}
+        n_nivel = st.get(f"n_{nivel}", len(sel))
+        facts = {"alcaldia": alc, "nivel": nivel, "total_tramos": n_nivel, "ejemplos": sel}
         fallback = f"Calles con nivel {nivel} en {alc}:\n{_fmt_list(sel, 15)}"
         return {"answer": _llm_with_facts("Redacta breve con ejemplos de calles.", facts, fallback)}
 
@@ -333,31 +335,15 @@ def chat(req: ChatReq):
     if m2:
         alc = _alcaldia_alias(m2.group(3) or "")
         try:
-            sc = _http_get("score", {
-                "hours": 72, "top_k": 5000, "tolerance_m": 5,
-                "use_hazard": False, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-            })
-            filas = sc.get("rows", [])
+            # p72_mm no depende de hazard: sirve la misma entrada por alcaldía
+            st = _alcaldia_stats(alc)
         except Exception as e:
             return {"answer": f"⚠️ No pude leer score: {e}"}
-        sel = [r for r in filas if _norm(r.get("alcaldia") or "").find(_norm(alc)) >= 0]
-        if not sel:
-            # fallback: intenta con hazard por si estaba vacío
-            try:
-                sc2 = _http_get("score", {
-                    "hours": 72, "top_k": 5000, "tolerance_m": 5,
-                    "use_hazard": True, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-                })
-                filas2 = sc2.get("rows", [])
-            except Exception:
-                filas2 = []
-            sel = [r for r in filas2 if _norm(r.get("alcaldia") or "").find(_norm(alc)) >= 0]
-            if not sel:
-                return {"answer": f"No tengo datos recientes para {alc}. Intenta con otra alcaldía o revisa más tarde."}
-        vals = [float(r.get("p72_mm") or 0.0) for r in sel]
-        avg = sum(vals)/len(vals); mx = max(vals); mn = min(vals)
-        facts = {"alcaldia": alc, "n_tramos": len(sel),
-                 "p72_prom_mm": round(avg, 1), "p72_max_mm": round(mx, 1), "p72_min_mm": round(mn, 1)}
+        if not st.get("n"):
+            return {"answer": f"No tengo datos recientes para {alc}. Intenta con otra alcaldía o revisa más tarde."}
+        facts = {"alcaldia": alc, "n_tramos": st["n"],
+                 "p72_prom_mm": round(st["p72_avg_mm"], 1), "p72_max_mm": round(st["p72_max_mm"], 1),
+                 "p72_min_mm": round(st["p72_min_mm"], 1)}
         fallback = (f"Lluvia 72h en {alc} (sobre {facts['n_tramos']} tramos): "
                     f"prom={facts['p72_prom_mm']} mm, máx={facts['p72_max_mm']} mm, mín={facts['p72_min_mm']} mm.")
         return {"answer": _llm_with_facts("Resume la lluvia prevista (72h).", facts, fallback)}
@@ -367,18 +353,14 @@ def chat(req: ChatReq):
     if m3:
         alc = _alcaldia_alias(m3.group(3) or "")
         try:
-            sc = _http_get("score", {
-                "hours": 72, "top_k": 5000, "tolerance_m": 5,
-                "use_hazard": True, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-            })
-            filas = sc.get("rows", [])
+            sel_sorted = _scores(alcaldia=alc, top_k=15, ascending=True, distinct=True)
+            st = _alcaldia_stats(alc)
         except Exception as e:
             return {"answer": f"⚠️ No pude leer score: {e}"}
-        sel = [r for r in filas if _norm(r.get("alcaldia") or "").find(_norm(alc)) >= 0]
-        if not sel:
+        if not sel_sorted:
             return {"answer": f"No tengo tramos cargados para {alc} en este momento."}
-        sel_sorted = sorted(sel, key=lambda r: float(r.get("score") or 0.0))
-        facts = {"alcaldia": alc, "total_tramos": len(sel), "top_menor_riesgo": sel_sorted[:15]}
+        facts = {"alcaldia": alc, "total_tramos": st.get("n", len(sel_sorted)),
+                 "top_menor_riesgo": sel_sorted}
         fallback = f"Calles con menor riesgo en {alc}:\n{_fmt_list(sel_sorted, 15)}"
         return {"answer": _llm_with_facts("Redacta breve con ejemplos.", facts, fallback)}
 
@@ -410,24 +392,17 @@ def chat(req: ChatReq):
             return {"answer": "No pude identificar el nombre de la calle. Intenta: «Riesgo en Calzada Ignacio Zaragoza (en Iztapalapa)»."}
 
         try:
-            sc = _http_get("score", {
-                "hours": 72, "top_k": 10000, "tolerance_m": 5,
-                "use_hazard": True, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-            })
-            filas = sc.get("rows", []) or []
+            matches = _best_match_streets(calle_q, alcaldia=alc_q, maxn=8)
+            if not matches and alc_q:
+                matches_any = _best_match_streets(calle_q, alcaldia=None, maxn=5)
+                if matches_any:
+                    sugerencias = _fmt_list(matches_any, 5)
+                    return {"answer": (f"No encontré tramos de «{calle_q}» en {alc_q}. "
+                                       f"Coincidencias en otras alcaldías:\n{sugerencias}")}
+                return {"answer": f"No encontré tramos de «{calle_q}» en {alc_q}. Prueba con un cruce o colonia cercana."}
         except Exception as e:
             return {"answer": f"⚠️ No pude leer score: {e}"}
 
-        matches = _best_match_streets(calle_q, filas, alcaldia=alc_q, maxn=8)
-
-        if not matches and alc_q:
-            matches_any = _best_match_streets(calle_q, filas, alcaldia=None, maxn=5)
-            if matches_any:
-                sugerencias = _fmt_list(matches_any, 5)
-                return {"answer": (f"No encontré tramos de «{calle_q}» en {alc_q}. "
-                                   f"Coincidencias en otras alcaldías:\n{sugerencias}")}
-            return {"answer": f"No encontré tramos de «{calle_q}» en {alc_q}. Prueba con un cruce o colonia cercana."}
-
         if not matches:
             return {"answer": f"No encontré tramos que contengan «{calle_q}». Prueba con un nombre más corto o un cruce."}
 
@@ -457,95 +432,39 @@ def chat(req: ChatReq):
     if m5:
         alc = _alcaldia_alias(m5.group(3) or "")
         try:
-            sc = _http_get("score", {
-                "hours": 72, "top_k": 8000, "tolerance_m": 5,
-                "use_hazard": True, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-            })
-            filas = sc.get("rows", []) or []
+            st = _alcaldia_stats(alc)
+            ejemplos = _scores(alcaldia=alc, top_k=12, distinct=True)
         except Exception as e:
             return {"answer": f"⚠️ No pude leer score: {e}"}
 
-        if not filas:
-            try:
-                sc = _http_get("score", {
-                    "hours": 72, "top_k": 8000, "tolerance_m": 5,
-                    "use_hazard": False, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-                })
-                filas = sc.get("rows", []) or []
-            except Exception:
-                filas = []
-
-        sel = [r for r in filas if _norm(r.get("alcaldia") or "").find(_norm(alc)) >= 0]
-        if not sel:
+        if not st.get("n"):
             return {"answer": f"No encontré tramos para {alc} en los datos actuales. Intenta con otra alcaldía o más tarde."}
 
-        n = len(sel)
-        n_alto = sum(1 for r in sel if _norm(r.get("nivel") or "") == "alto")
-        prom_score = sum(float(r.get("score") or 0.0) for r in sel)/n
-        prom_mm = sum(float(r.get("p72_mm") or 0.0) for r in sel)/n
         facts = {
-            "alcaldia": alc, "tramos": n, "tramos_alto": n_alto,
-            "score_prom": round(prom_score, 2), "p72_prom_mm": round(prom_mm, 1),
-            "ejemplos": sel[:12],
+            "alcaldia": alc, "tramos": st["n"], "tramos_alto": st["n_alto"],
+            "score_prom": round(st["score_avg"], 2), "score_p90": round(st["score_p90"], 2),
+            "p72_prom_mm": round(st["p72_avg_mm"], 1), "p72_p90_mm": round(st["p72_p90_mm"], 1),
+            "ejemplos": ejemplos,
         }
-        fallback = (f"Riesgo en {alc} (72h): alto={n_alto}/{n} tramos, "
+        fallback = (f"Riesgo en {alc} (72h): alto={facts['tramos_alto']}/{facts['tramos']} tramos, "
                     f"score_prom={facts['score_prom']:.2f}, p72_prom={facts['p72_prom_mm']:.1f} mm.\n"
-                    f"Ejemplos:\n{_fmt_list(sel, 8)}")
+                    f"Ejemplos:\n{_fmt_list(ejemplos, 8)}")
         return {"answer": _llm_with_facts("Resume el riesgo general por alcaldía (72h).", facts, fallback)}
 
     # 7) Top alcaldías (lluvia/riesgo/inundación)
     if _re_top_alc.search(msg_nop):
         try:
-            sc = _http_get("score", {
-                "hours": 72, "top_k": 12000, "tolerance_m": 5,
-                "use_hazard": True, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-            })
-            filas = sc.get("rows", []) or []
+            # Agregado por alcaldía en SQL (ya ordenado); descarta alcaldías con menos de 5 tramos
+            items = [r for r in _alcaldias() if r["n"] >= 5][:10]
         except Exception as e:
             return {"answer": f"⚠️ No pude leer score: {e}"}
 
-        if not filas:
-            try:
-                sc = _http_get("score", {
-                    "hours": 72, "top_k": 12000, "tolerance_m": 5,
-                    "use_hazard": False, "min_mm": 0.0, "only_cdmx": True, "mm_ref": 80
-                })
-                filas = sc.get("rows", []) or []
-            except Exception:
-                filas = []
-
-        if not filas:
-            return {"answer": "No hay filas disponibles en /score para calcular el top de alcaldías en este momento."}
-
-        agg: Dict[str, Dict[str, Any]] = {}
-        for r in filas:
-            alc = (r.get("alcaldia") or "-").strip()
-            s   = float(r.get("score") or 0.0)
-            mm  = float(r.get("p72_mm") or 0.0)
-            lvl = _norm(r.get("nivel") or "")
-            a = agg.setdefault(alc, {"n": 0, "n_alto": 0, "sum_score": 0.0, "sum_mm": 0.0, "max_score": 0.0})
-            a["n"] += 1
-            if lvl == "alto":
-                a["n_alto"] += 1
-            a["sum_score"] += s
-            a["sum_mm"]    += mm
-            a["max_score"]  = max(a["max_score"], s)
-
-        items = []
-        for alc, v in agg.items():
-            if v["n"] == 0 or alc == "-" or v["n"] < 5:  # filtra sin nombre y pocos tramos
-                continue
-            prom_score = v["sum_score"]/v["n"]
-            prom_mm    = v["sum_mm"]/v["n"]
-            items.append((alc, v["n_alto"], prom_score, v["max_score"], prom_mm))
-
         if not items:
-            return {"answer": "Tengo filas, pero el agregado por alcaldía quedó vacío. Intenta de nuevo en unos minutos."}
+            return {"answer": "No hay calles con score para calcular el top de alcaldías en este momento."}
 
-        items.sort(key=lambda x: (x[1], x[2]), reverse=True)
-        top = items[:10]
-        lines = [f"• {alc}: alto={n_al} | score_prom={prom:.2f} | score_max={mx:.2f} | p72_prom={mm:.1f} mm"
-                 for (alc, n_al, prom, mx, mm) in top]
+        lines = [f"• {r['alcaldia']}: alto={r['n_alto']} | score_prom={r['score_avg']:.2f} | "
+                 f"score_max={r['score_max']:.2f} | p72_prom={r['p72_avg_mm']:.1f} mm"
+                 for r in items]
         facts = {"top_alcaldias": lines}
         fallback = "**Top alcaldías (72h, según backend)**\n" + "\n".join(lines)
         return {"answer": _llm_with_facts("Redacta un top breve de alcaldías (72h).", facts, fallback)}
@@ -555,4 +474,4 @@ def chat(req: ChatReq):
         return {"answer": _llm_general(raw)}
 
     # 9) Pregunta de tema clima pero sin encajar arriba → IA general (con fallback útil)
-    return {"answer": _llm_general(raw)}
\ No newline at end of file
+    return {"answer": _llm_general(raw)}
@@ -1,16 +1,24 @@
 import json
 import math
-import requests
 from datetime import datetime, timedelta, timezone
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
 from typing import List, Any, Optional
 from sqlalchemy import text
-from ..db import engine
+from ..db import engine, run_read
+from .. import scoring, openmeteo, ingest, runs, grids, cache
 from dateutil import tz
 
 router = APIRouter(prefix="/forecast", tags=["forecast"])
 
+# Horas máximas de serie horaria guardadas por celda (7 días)
+SERIES_HOURS = 168
+# Ventanas estándar que reporta /forecast/summary
+SUMMARY_WINDOWS = (6, 24, 72, 168)
+
+# Tope de celdas por corrida (con lotes multi-coordenada ya no es por peticiones)
+MAX_GRID_CELLS = 5000
+
 # ======= Modelos de entrada =======
 class ForecastCell(BaseModel):
     ts: datetime = Field(..., description="Timestamp UTC de la celda")
@@ -21,79 +29,107 @@ class ForecastPayload(BaseModel):
     horizon_h: int = Field(72, description="Ventana de pronóstico en horas (default 72)")
     cells: List[ForecastCell]
 
+def _utc_naive(ts: datetime) -> datetime:
+    """Timestamp en UTC sin tzinfo; los naive se toman como UTC."""
+    if ts.tzinfo is None:
+        return ts
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
 # ======= POST /forecast (carga manual) =======
 @router.post("")
 def load_forecast(payload: ForecastPayload):
     """
-    Inserta/adjunta celdas de pronóstico en precip_forecast.
+    Carga las celdas como una corrida nueva (source='manual') y la activa al terminar.
     Espera polígonos GeoJSON (WGS84), ts (UTC) y mm por celda.
     """
     if not payload.cells:
         raise HTTPException(status_code=400, detail="No hay celdas en el payload.")
 
-    inserted = 0
-    sql = text("""
-        INSERT INTO precip_forecast (ts, mm, geom)
-        VALUES (:ts, :mm, ST_SetSRID(ST_GeomFromGeoJSON(:geom), 4326))
-    """)
+    # UTC sin zona (columnas TIMESTAMP): con offset se convierte, sin offset ya es UTC.
+    # Mezclar ambos rompería min/max y COPY descartaría el offset.
+    ts_all = [_utc_naive(c.ts) for c in payload.cells]
+    run_id = runs.create_run("manual", window_from=min(ts_all), window_to=max(ts_all),
+                             series_start=min(ts_all))
 
+    # COPY a staging + INSERT ... SELECT (una sola sentencia set-based).
+    # Sin serie horaria: cada celda queda como serie de un valor (mm en toda ventana).
+    rows = ((ts, c.mm, None, None, None, json.dumps(c.geom)) for ts, c in zip(ts_all, payload.cells))
     try:
         with engine.begin() as conn:
-            for c in payload.cells:
-                geom_json = json.dumps(c.geom)  # dict -> string JSON
-                conn.execute(sql, {"ts": c.ts, "mm": c.mm, "geom": geom_json})
-                inserted += 1
+            bulk = ingest.copy_forecast_cells(conn, run_id, rows, geom_format="geojson")
+            # street_scores + activación en la misma transacción
+            scoring.refresh_street_scores(conn, run_id)
+            runs.activate_run(conn, run_id, bulk["rows"])
     except Exception as e:
+        runs.fail_run(run_id, repr(e))
         raise HTTPException(status_code=500, detail=f"Inserción falló: {e}")
 
-    return {"ok": True, "inserted": inserted, "horizon_h": payload.horizon_h}
+    # Las llaves ya incluyen el run_id; limpiar solo libera memoria
+    cache.invalidate()
+    runs.prune_in_background()
+    inserted = bulk["rows"]
+    return {"ok": True, "run_id": run_id, "inserted": inserted, "horizon_h": payload.horizon_h, "bulk": bulk}
 
 # ======= GET /forecast/summary =======
 @router.get("/summary")
-def forecast_summary(
+async def forecast_summary(
     bbox: Optional[str] = None,
-    from_hours: int = 0,
-    to_hours: int = 72,
+    from_hours: int = Query(0, ge=0, le=SERIES_HOURS),
+    to_hours: int = Query(72, ge=1, le=SERIES_HOURS),
 ):
     """
-    Devuelve suma de mm y conteo de celdas entre now()+from_hours y now()+to_hours.
+    Devuelve conteo de celdas de la corrida activa, suma de mm entre las horas
+    from_hours y to_hours de la serie, pico horario y acumulados 6/24/72/168h.
+    Usa las sumas prefijas (mm_cum) de cada celda: O(1) por celda y ventana.
     Opcionalmente filtra por bbox = 'minx,miny,maxx,maxy' (WGS84).
     """
-    now_utc = datetime.now(tz=tz.UTC)
-    t0 = now_utc + timedelta(hours=from_hours)
-    t1 = now_utc + timedelta(hours=to_hours)
-
-    base = """
-        SELECT COUNT(*)::int AS n_cells, COALESCE(SUM(mm),0)::float AS mm_sum
-        FROM precip_forecast
-        WHERE ts >= :t0 AND ts <= :t1
-    """
+    if to_hours <= from_hours:
+        raise HTTPException(status_code=400, detail="to_hours debe ser mayor que from_hours")
 
-    params = {"t0": t0, "t1": t1}
-    if bbox:
-        try:
-            minx, miny, maxx, maxy = [float(x) for x in bbox.split(",")]
-        except Exception:
-            raise HTTPException(status_code=400, detail="bbox debe ser 'minx,miny,maxx,maxy'")
-        base += " AND ST_Intersects(geom, ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326))"
-        params.update({"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy})
+    def read(conn):
+        return (scoring.forecast_summary(conn, from_hours, to_hours, bbox, windows=SUMMARY_WINDOWS),
+                runs.active_run(conn))
+
+    try:
+        summ, run = await run_read(read)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox debe ser 'minx,miny,maxx,maxy'")
 
-    with engine.connect() as conn:
-        row = conn.execute(text(base), params).mappings().first()
+    start = (run or {}).get("series_start") or datetime.now(tz=tz.UTC).replace(tzinfo=None)
+    t0 = start + timedelta(hours=from_hours)
+    t1 = start + timedelta(hours=to_hours)
 
     return {
+        "run_id": (run or {}).get("id"),
         "window_utc": {"from": t0.isoformat(), "to": t1.isoformat()},
         "bbox": bbox,
-        "n_cells": row["n_cells"],
-        "mm_sum": row["mm_sum"],
+        **summ,
     }
 
+# ======= GET /forecast/runs =======
+@router.get("/runs")
+async def forecast_runs(limit: int = Query(20, ge=1, le=200)):
+    """Últimas corridas registradas (la activa primero)."""
+    def read(conn):
+        return conn.execute(text("""
+            SELECT id, source, issued_at, activated_at, window_from, window_to,
+                   bbox, step_deg, status, n_cells, is_active, error
+            FROM forecast_runs
+            ORDER BY is_active DESC, id DESC
+            LIMIT :limit
+        """), {"limit": limit}).mappings().all()
+
+    rows = await run_read(read)
+    return {"runs": [dict(r) for r in rows]}
+
 # ========= MODELO y endpoint Open-Meteo =========
 class OpenMeteoReq(BaseModel):
     bbox: str = Field(..., description="minx,miny,maxx,maxy en WGS84 (ej. -99.36,19.18,-98.94,19.59)")
     step_deg: float = Field(0.06, ge=0.01, le=0.2, description="Tamaño de celda (grados). 0.06 ≈ ~6 km aprox.")
     hours: int = Field(72, ge=6, le=168, description="Ventana de horas a sumar (default 72)")
-    clear_previous: bool = Field(True, description="Borra pronóstico previo en la ventana antes de insertar")
+    clear_previous: bool = Field(True, description="Poda en segundo plano las corridas anteriores al activar esta")
+    batch_size: int = Field(openmeteo.BATCH_SIZE, ge=1, le=500, description="Coordenadas por petición a Open-Meteo (1 = una por punto)")
+    concurrency: int = Field(openmeteo.CONCURRENCY, ge=1, le=64, description="Peticiones simultáneas a Open-Meteo")
 
 def frange(a: float, b: float, step: float):
     vals = []
@@ -115,92 +151,101 @@ def load_openmeteo(req: OpenMeteoReq):
         # 2) Rejilla (centroides)
         lons = frange(minx, maxx, req.step_deg)
         lats = frange(miny, maxy, req.step_deg)
-        if len(lons) * len(lats) > 200:
-            raise HTTPException(status_code=400, detail="Rejilla muy grande. Usa step_deg más grande (ej. 0.08).")
+        if len(lons) * len(lats) > MAX_GRID_CELLS:
+            raise HTTPException(status_code=400,
+                                detail=f"Rejilla muy grande ({len(lons) * len(lats)} celdas, máximo {MAX_GRID_CELLS}). "
+                                       f"Usa step_deg mayor que {req.step_deg:g} o un bbox más chico.")
 
         # Ventana naive (UTC) para evitar choque con tz en la columna TIMESTAMP
         t0 = datetime.utcnow()
         t1 = t0 + timedelta(hours=req.hours)
 
-        inserted = 0
-        sql_insert = text("""
-            INSERT INTO precip_forecast (ts, mm, geom)
-            VALUES (:ts, :mm, ST_SetSRID(ST_GeomFromGeoJSON(:geom), 4326))
-        """)
-
-        # 3) Limpiar ventana previa (opcional)
-        if req.clear_previous:
-            with engine.begin() as conn:
-                conn.execute(
-                    text("DELETE FROM precip_forecast WHERE ts BETWEEN :t0 AND :t1"),
-                    {"t0": t0, "t1": t1}
-                )
-
-        # 4) Por cada punto, pedir Open-Meteo, sumar mm y guardar celda
-        with engine.begin() as conn:
-            for lat in lats:
-                for lon in lons:
-                    url = "https://api.open-meteo.com/v1/forecast"
-                    params = {
-                        "latitude": lat,
-                        "longitude": lon,
-                        "hourly": "precipitation",
-                        "forecast_days": 7,
-                        "timezone": "UTC"
-                    }
+        # 3) Descarga concurrente ANTES de abrir la transacción
+        points = [(lat, lon) for lat in lats for lon in lons]
+        fetched, fetch_stats = openmeteo.fetch_grid(
+            points, batch_size=req.batch_size, concurrency=req.concurrency
+        )
+
+        # 4) Por cada punto descargado: serie horaria desde la hora actual (hasta 168h),
+        #    sumas/máximos prefijos y total de la ventana pedida
+        series_start = t0.replace(minute=0, second=0, microsecond=0)
+        half = req.step_deg / 2.0
+        cells = []
+        for iy, lat in enumerate(lats):
+            for ix, lon in enumerate(lons):
+                data = fetched.get((lat, lon))
+                if data is None:
+                    continue
+
+                times = data.get("hourly", {}).get("time", [])
+                precs = data.get("hourly", {}).get("precipitation", [])
+                if not times or not precs or len(times) != len(precs):
+                    continue
+
+                hourly = []
+                for iso, mm in zip(times, precs):
                     try:
-                        r = requests.get(url, params=params, timeout=15)
-                        r.raise_for_status()
-                        data = r.json()
-                    except Exception as e:
-                        print(f"Open-Meteo fallo en {lat},{lon}: {e}")
-                        continue
-
-                    times = data.get("hourly", {}).get("time", [])
-                    precs = data.get("hourly", {}).get("precipitation", [])
-                    if not times or not precs or len(times) != len(precs):
-                        continue
-
-                    total_mm = 0.0
-                    for iso, mm in zip(times, precs):
-                        try:
-                            # parse a aware y luego quita tz -> naive
-                            ts = datetime.fromisoformat(iso.replace("Z", "+00:00")).replace(tzinfo=None)
-                        except Exception:
-                            continue
-                        if t0 <= ts <= t1:
-                            total_mm += (mm or 0.0)
-
-                    # Polígono cuadrado alrededor del punto (± step/2)
-                    half = req.step_deg / 2.0
-                    poly = {
-                        "type": "Polygon",
-                        "coordinates": [[
-                            [lon - half, lat - half],
-                            [lon + half, lat - half],
-                            [lon + half, lat + half],
-                            [lon - half, lat + half],
-                            [lon - half, lat - half],
-                        ]]
-                    }
-
-                    if total_mm <= 0:
+                        # parse a aware y luego quita tz -> naive
+                        ts = datetime.fromisoformat(iso.replace("Z", "+00:00")).replace(tzinfo=None)
+                    except Exception:
                         continue
-
-                    conn.execute(sql_insert, {
-                        "ts": t0,                 # marca de corrida (naive UTC)
-                        "mm": float(total_mm),
-                        "geom": json.dumps(poly)
-                    })
-                    inserted += 1
+                    if ts >= series_start:
+                        hourly.append(mm or 0.0)
+                hourly = hourly[:SERIES_HOURS]
+                if not hourly:
+                    continue
+
+                mm_cum, peak_cum = ingest.prefix_series(hourly)
+                if mm_cum[-1] <= 0:
+                    continue
+                total_mm = mm_cum[min(req.hours, len(mm_cum)) - 1]
+
+                # Polígono cuadrado alrededor del punto (± step/2); ts = marca de corrida (naive UTC)
+                cells.append((t0, float(total_mm), mm_cum, peak_cum,
+                              grids.cell_index(ix, iy, len(lons)), ingest.cell_wkt(lon, lat, half)))
+
+        # 5) Corrida nueva: celdas + street_scores + activación en UNA transacción.
+        #    Los lectores ven la corrida anterior completa hasta el COMMIT.
+        if fetch_stats["ok"] == 0:
+            raise RuntimeError("Open-Meteo no devolvió ningún punto; se conserva la corrida activa")
+        # Mapeo calle -> celdas: una sola vez por especificación de rejilla
+        with engine.begin() as conn:
+            grid = grids.ensure_grid(conn, lons[0], lats[0], req.step_deg, len(lons), len(lats))
+            if grid["built_at"] is None:
+                grid_build = grids.build_street_cells(conn, grid["id"])
+                print(f"[forecast] street_cells rejilla {grid['id']}: {grid_build}")
+
+        run_id = runs.create_run("openmeteo", window_from=t0, window_to=t1,
+                                 series_start=series_start, bbox=req.bbox, step_deg=req.step_deg,
+                                 grid_id=grid["id"])
+        try:
+            with engine.begin() as conn:
+                bulk = ingest.copy_forecast_cells(conn, run_id, cells, geom_format="wkt")
+                scores = scoring.refresh_street_scores(conn, run_id)
+                runs.activate_run(conn, run_id, bulk["rows"])
+        except Exception as e:
+            runs.fail_run(run_id, repr(e))
+            raise
+        cache.invalidate()
+        inserted = bulk["rows"]
+
+        # 6) Corridas viejas: poda por lotes fuera del camino crítico
+        if req.clear_previous:
+            runs.prune_in_background()
 
         return {
             "ok": True,
+            "run_id": run_id,
             "inserted": inserted,
             "window_utc": {"from": t0.isoformat(), "to": t1.isoformat()},
-            "grid": {"nx": len(lons), "ny": len(lats), "step_deg": req.step_deg}
+            "grid": {"id": grid["id"], "nx": len(lons), "ny": len(lats), "step_deg": req.step_deg},
+            "fetch": fetch_stats,
+            "bulk": bulk,
+            "street_scores": scores,
         }
 
+    except HTTPException:
+        raise  # los 400 de validación salen tal cual
     except Exception as e:
         # <-- este except CIERRA el try de arriba, al MISMO nivel de indentación
         raise HTTPException(status_code=500, detail=f"openmeteo falló: {e!r}")
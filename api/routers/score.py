@@ -1,16 +1,24 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from datetime import datetime, timedelta
-from sqlalchemy import text
-from ..db import engine
+from ..db import engine, read_connect
+from .. import scoring, runs, grids, hazard, enrich, tiles
+from ..cache import score_cache, tile_cache, invalidate
+from ..http_cache import Snapshot, revalidate, encoded_response, streamed_response, json_bytes
 
 router = APIRouter(prefix="/score", tags=["score"])
 
+# Bytes acumulados antes de enviar un bloque en /score/geojson?stream=true
+STREAM_CHUNK_BYTES = 64 * 1024
+# Tope por sentencia para tiles (ms): el mapa pide muchos y prefiere 503 a esperar
+TILE_TIMEOUT_MS = 10000
+
 class ScoreRow(BaseModel):
     calle: str
     alcaldia: Optional[str]
     p72_mm: float
+    peak_mm_h: Optional[float] = None
     hazard: float
     score: float
     nivel: str
@@ -22,9 +30,35 @@ class ScoreResponse(BaseModel):
     top_k: int
     rows: List[ScoreRow]
 
+# ====================== helpers ======================
+def _check_bbox(bbox: Optional[str]) -> None:
+    try:
+        scoring.street_filters(bbox, False)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox debe ser 'minx,miny,maxx,maxy'")
+
+async def _feature_stream(query: dict, snap: Snapshot) -> AsyncIterator[bytes]:
+    """
+    FeatureCollection por partes: encabezado, features separados por coma (en bloques) y cierre.
+    Lee la corrida de `snap` en su réplica (la misma de la llave de caché).
+    """
+    async with read_connect(snap.replica) as conn:
+        chunk, size, sep = ['{"type":"FeatureCollection","features":['], 0, ""
+        async for feat in scoring.aiter_features(conn, run_id=snap.run_id, **query):
+            chunk.append(sep)
+            chunk.append(feat)
+            sep = ","
+            size += len(feat)
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(chunk).encode()
+                chunk, size = [], 0
+        chunk.append("]}")
+        yield "".join(chunk).encode()
+
 # ====================== /score ======================
 @router.get("", response_model=ScoreResponse)
-def score_flood(
+async def score_flood(
+    request: Request,
     hours: int = Query(72, ge=1, le=168),
     top_k: int = Query(10, ge=1, le=50000),
     bbox: Optional[str] = Query(None, description="minx,miny,maxx,maxy (WGS84)"),
@@ -32,110 +66,45 @@ def score_flood(
     use_hazard: bool = Query(True, description="Si False, ignora hazard"),
     min_mm: float = Query(0.0, ge=0.0, description="Filtra calles con lluvia acumulada mínima"),
     only_cdmx: bool = Query(False, description="Si True, solo calles dentro de alcaldías CDMX"),
-    mm_ref: float = Query(80.0, gt=0, description="mm de referencia para normalizar (default 80)")
+    mm_ref: float = Query(80.0, gt=0, description="mm de referencia para normalizar (default 80)"),
+    weight_by_overlap: bool = Query(False, description="Pondera la lluvia por la fracción de la calle dentro de cada celda")
 ):
     """
-    Puntaje por calle usando el último pronóstico cargado (MAX(ts)).
+    Puntaje por calle usando la corrida de pronóstico activa (forecast_runs).
+    Si hours está en SCORE_WINDOWS y la tolerancia en SCORE_TOLERANCES se lee de street_scores
+    (precalculado); si no, se deriva de street_cells y las series prefijas de cada celda.
+    p72_mm = lluvia acumulada en las primeras `hours` horas de la corrida; peak_mm_h = máximo horario.
     score = 0.3*hazard + 0.7*min(1, p72/mm_ref)
     nivel: Alto (>=0.70), Medio (>=0.30), Bajo (<0.30)
     """
-    t0 = datetime.utcnow()
-    t1 = t0 + timedelta(hours=hours)
-
-    where_extra = ""
-    params = {"top_k": top_k, "tol_m": tolerance_m, "min_mm": min_mm, "mm_ref": mm_ref}
-
-    if bbox:
-        try:
-            minx, miny, maxx, maxy = [float(x) for x in bbox.split(",")]
-        except Exception:
-            raise HTTPException(status_code=400, detail="bbox debe ser 'minx,miny,maxx,maxy'")
-        where_extra += " AND ST_Intersects(c.geom, ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326))"
-        params.update({"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy})
-
-    if only_cdmx:
-        where_extra += " AND EXISTS (SELECT 1 FROM alcaldias a WHERE ST_Intersects(c.geom, a.geom))"
-
-    # Prefiltro con índice + distancia precisa si hay tolerancia
-    metric_join = (
-        "(c.geom && p.geom AND ST_DWithin(ST_Transform(c.geom,3857), ST_Transform(p.geom,3857), :tol_m))"
-        if tolerance_m > 0 else
-        "(c.geom && p.geom AND ST_Intersects(c.geom, p.geom))"
-    )
-
-    # Hazard usando EXISTS (incluye tabla f y prefiltro &&)
-    if use_hazard:
-        hazard_expr = (
-            "EXISTS (SELECT 1 FROM flood_polygons f "
-            "        WHERE c.geom && f.geom "
-            "          AND ST_DWithin(ST_Transform(c.geom,3857), ST_Transform(f.geom,3857), :tol_m))"
-            if tolerance_m > 0 else
-            "EXISTS (SELECT 1 FROM flood_polygons f "
-            "        WHERE c.geom && f.geom "
-            "          AND ST_Intersects(c.geom, f.geom))"
-        )
-    else:
-        hazard_expr = "FALSE"
-
-    having_clause = "HAVING COALESCE(SUM(p.mm),0) >= :min_mm"
-
-    sql = text(f"""
-        WITH last AS (
-            SELECT MAX(ts) AS ts_last FROM precip_forecast
-        ),
-        p AS (
-            SELECT id, mm, geom
-            FROM precip_forecast, last
-            WHERE precip_forecast.ts = last.ts_last
-        ),
-        agg AS (
-            SELECT
-                c.id AS calle_id,
-                c.nombre AS calle,
-                c.alcaldia AS alcaldia,
-                COALESCE(SUM(p.mm), 0) AS p72_mm,
-                CASE WHEN {hazard_expr} THEN 1.0 ELSE 0.0 END AS hazard
-            FROM calles c
-            LEFT JOIN p ON {metric_join}
-            WHERE 1=1 {where_extra}
-            GROUP BY c.id, c.nombre, c.alcaldia
-            {having_clause}
-        ),
-        scored AS (
-            SELECT
-                calle,
-                alcaldia,
-                p72_mm,
-                hazard,
-                0.3*hazard + 0.7*LEAST(1, p72_mm/:mm_ref) AS score
-            FROM agg
-        )
-        SELECT
-            calle, alcaldia, p72_mm, hazard, score,
-            CASE
-                WHEN score >= 0.70 THEN 'Alto'
-                WHEN score >= 0.30 THEN 'Medio'
-                ELSE 'Bajo'
-            END AS nivel
-        FROM scored
-        ORDER BY score DESC
-        LIMIT :top_k
-    """)
-
-    with engine.connect() as conn:
-        rows = [dict(r) for r in conn.execute(sql, params).mappings().all()]
-
-    return ScoreResponse(
-        run_window_utc_from=t0.isoformat(),
-        run_window_utc_to=t1.isoformat(),
-        bbox=bbox,
-        top_k=top_k,
-        rows=[ScoreRow(**r) for r in rows]
-    )
+    _check_bbox(bbox)
+    query = dict(hours=hours, top_k=top_k, bbox=bbox, tolerance_m=tolerance_m, use_hazard=use_hazard,
+                 min_mm=min_mm, only_cdmx=only_cdmx, mm_ref=mm_ref, weighted=weight_by_overlap)
+    key, headers, not_modified, snap = await revalidate(request, "score", **query)
+    if not_modified:
+        return not_modified
+
+    async def compute() -> bytes:
+        rows = await snap.read(scoring.score_rows, run_id=snap.run_id, **query)
+
+        # Ventana: desde el inicio de la serie de la corrida de la llave
+        t0 = snap.run.get("series_start") or datetime.utcnow()
+        t1 = t0 + timedelta(hours=hours)
+
+        return json_bytes(ScoreResponse(
+            run_window_utc_from=t0.isoformat(),
+            run_window_utc_to=t1.isoformat(),
+            bbox=bbox,
+            top_k=top_k,
+            rows=[ScoreRow(calle=r.pop("nombre"), **r) for r in rows]
+        ))
+
+    return await encoded_response(request, key, headers, compute, score_cache)
 
 # ====================== /score/geojson ======================
 @router.get("/geojson")
-def score_geojson(
+async def score_geojson(
+    request: Request,
     hours: int = Query(72, ge=1, le=168),
     top_k: int = Query(50, ge=1, le=50000),
     bbox: Optional[str] = Query(None, description="minx,miny,maxx,maxy (WGS84)"),
@@ -143,86 +112,135 @@ def score_geojson(
     use_hazard: bool = Query(True, description="Si False, ignora hazard"),
     min_mm: float = Query(0.0, ge=0.0, description="Filtra calles con lluvia acumulada mínima"),
     only_cdmx: bool = Query(False, description="Si True, solo calles dentro de alcaldías CDMX"),
-    mm_ref: float = Query(80.0, gt=0, description="mm de referencia para normalizar (default 80)")
+    mm_ref: float = Query(80.0, gt=0, description="mm de referencia para normalizar (default 80)"),
+    weight_by_overlap: bool = Query(False, description="Pondera la lluvia por la fracción de la calle dentro de cada celda"),
+    stream: bool = Query(True, description="Si True, arma los features en SQL y los transmite por partes"),
+    simplify_m: Optional[float] = Query(None, ge=0, description="Tolerancia de simplificación en metros (usa columnas presimplificadas 5/20/80 m)"),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="Zoom del mapa; si no hay simplify_m, simplifica a ~1 pixel"),
+    precision: int = Query(6, ge=0, le=15, description="Decimales de las coordenadas (6 ≈ 0.1 m)"),
+):
+    """
+    FeatureCollection de calles con score. Con `stream` (default) PostGIS arma cada
+    Feature como texto y se leen con cursor del lado del servidor: memoria y tiempo
+    al primer byte no crecen con top_k; se comprime al vuelo y el resultado codificado
+    queda en caché. `simplify_m`/`zoom` y `precision` reducen vértices y decimales.
+    """
+    _check_bbox(bbox)
+    if simplify_m is None and zoom is not None:
+        simplify_m = scoring.zoom_simplify_m(zoom)
+    query = dict(hours=hours, top_k=top_k, bbox=bbox, tolerance_m=tolerance_m, use_hazard=use_hazard,
+                 min_mm=min_mm, only_cdmx=only_cdmx, mm_ref=mm_ref, weighted=weight_by_overlap,
+                 simplify_m=simplify_m or 0.0, precision=precision)
+    # Ambos modos producen el mismo documento: comparten llave, ETag y caché
+    key, headers, not_modified, snap = await revalidate(request, "geojson", **query)
+    if not_modified:
+        return not_modified
+    if stream:
+        return await streamed_response(request, key, headers, lambda: _feature_stream(query, snap), score_cache)
+
+    async def compute() -> bytes:
+        rows = await snap.read(scoring.score_rows, with_geom=True, run_id=snap.run_id, **query)
+
+        features = []
+        for r in rows:
+            geom = r.pop("geom_json")
+            features.append({"type": "Feature", "geometry": geom, "properties": r})
+
+        return json_bytes({"type": "FeatureCollection", "features": features})
+
+    return await encoded_response(request, key, headers, compute, score_cache)
+
+# ====================== /score/alcaldias ======================
+@router.get("/alcaldias")
+async def score_alcaldias(
+    request: Request,
+    hours: int = Query(72, ge=1, le=168),
+    tolerance_m: float = Query(0, ge=0, le=50),
+    use_hazard: bool = Query(True, description="Si False, ignora hazard"),
+    min_mm: float = Query(0.0, ge=0.0, description="Filtra calles con lluvia acumulada mínima"),
+    only_cdmx: bool = Query(False, description="Si True, solo calles dentro de alcaldías CDMX"),
+    mm_ref: float = Query(80.0, gt=0, description="mm de referencia para normalizar (default 80)"),
+    weight_by_overlap: bool = Query(False, description="Pondera la lluvia por la fracción de la calle dentro de cada celda"),
+    min_rows: int = Query(1, ge=1, description="Descarta alcaldías con menos calles"),
 ):
-    where_extra = ""
-    params = {"top_k": top_k, "tol_m": tolerance_m, "min_mm": min_mm, "mm_ref": mm_ref}
-
-    if bbox:
-        try:
-            minx, miny, maxx, maxy = [float(x) for x in bbox.split(",")]
-        except Exception:
-            raise HTTPException(status_code=400, detail="bbox debe ser 'minx,miny,maxx,maxy'")
-        where_extra += " AND ST_Intersects(c.geom, ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326))"
-        params.update({"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy})
-
-    if only_cdmx:
-        where_extra += " AND EXISTS (SELECT 1 FROM alcaldias a WHERE ST_Intersects(c.geom, a.geom))"
-
-    metric_join = (
-        "(c.geom && p.geom AND ST_DWithin(ST_Transform(c.geom,3857), ST_Transform(p.geom,3857), :tol_m))"
-        if tolerance_m > 0 else
-        "(c.geom && p.geom AND ST_Intersects(c.geom, p.geom))"
-    )
-
-    if use_hazard:
-        hazard_expr = (
-            "EXISTS (SELECT 1 FROM flood_polygons f "
-            "        WHERE c.geom && f.geom "
-            "          AND ST_DWithin(ST_Transform(c.geom,3857), ST_Transform(f.geom,3857), :tol_m))"
-            if tolerance_m > 0 else
-            "EXISTS (SELECT 1 FROM flood_polygons f "
-            "        WHERE c.geom && f.geom "
-            "          AND ST_Intersects(c.geom, f.geom))"
-        )
-    else:
-        hazard_expr = "FALSE"
-
-    having_clause = "HAVING COALESCE(SUM(p.mm),0) >= :min_mm"
-
-    sql = text(f"""
-        WITH last AS (
-            SELECT MAX(ts) AS ts_last FROM precip_forecast
-        ),
-        p AS (
-            SELECT id, mm, geom
-            FROM precip_forecast, last
-            WHERE precip_forecast.ts = last.ts_last
-        ),
-        agg AS (
-            SELECT
-                c.id, c.nombre, c.alcaldia, c.geom,
-                COALESCE(SUM(p.mm), 0) AS p72_mm,
-                CASE WHEN {hazard_expr} THEN 1.0 ELSE 0.0 END AS hazard
-            FROM calles c
-            LEFT JOIN p ON {metric_join}
-            WHERE 1=1 {where_extra}
-            GROUP BY c.id, c.nombre, c.alcaldia, c.geom
-            {having_clause}
-        ),
-        scored AS (
-            SELECT
-                id, nombre, alcaldia, geom, p72_mm, hazard,
-                0.3*hazard + 0.7*LEAST(1, p72_mm/:mm_ref) AS score
-            FROM agg
-        )
-        SELECT
-            nombre, alcaldia, p72_mm, hazard, score,
-            CASE WHEN score >= 0.70 THEN 'Alto'
-                 WHEN score >= 0.30 THEN 'Medio'
-                 ELSE 'Bajo' END AS nivel,
-            ST_AsGeoJSON(geom)::json AS geom_json
-        FROM scored
-        ORDER BY score DESC
-        LIMIT :top_k
-    """)
-
-    with engine.connect() as conn:
-        rows = [dict(r) for r in conn.execute(sql, params).mappings().all()]
-
-    features = []
-    for r in rows:
-        geom = r.pop("geom_json")
-        features.append({"type": "Feature", "geometry": geom, "properties": r})
-
-    return {"type": "FeatureCollection", "features": features}
+    """
+    Estadísticas por alcaldía sobre todas las calles (sin top_k): conteo por nivel,
+    promedio/máximo/p50/p90 de score y p72_mm. Ordenado por calles en nivel Alto.
+    """
+    query = dict(hours=hours, tolerance_m=tolerance_m, use_hazard=use_hazard, min_mm=min_mm,
+                 only_cdmx=only_cdmx, mm_ref=mm_ref, weighted=weight_by_overlap, min_rows=min_rows)
+    key, headers, not_modified, snap = await revalidate(request, "alcaldias", **query)
+    if not_modified:
+        return not_modified
+
+    async def compute() -> bytes:
+        return json_bytes(await snap.read(scoring.alcaldia_summary, run_id=snap.run_id, **query))
+
+    return await encoded_response(request, key, headers, compute, score_cache)
+
+# ====================== /score/tiles ======================
+@router.get("/tiles/{z}/{x}/{y}.mvt")
+async def score_tile(
+    request: Request,
+    z: int,
+    x: int,
+    y: int,
+    hours: int = Query(72, ge=1, le=168),
+    tolerance_m: float = Query(0, ge=0, le=50),
+    use_hazard: bool = Query(True, description="Si False, ignora hazard"),
+    min_mm: float = Query(0.0, ge=0.0, description="Filtra calles con lluvia acumulada mínima"),
+    only_cdmx: bool = Query(False, description="Si True, solo calles dentro de alcaldías CDMX"),
+    mm_ref: float = Query(80.0, gt=0, description="mm de referencia para normalizar (default 80)"),
+    weight_by_overlap: bool = Query(False, description="Pondera la lluvia por la fracción de la calle dentro de cada celda"),
+):
+    """
+    Vector tile (MVT, capa 'calles') con las calles con score del tile z/x/y.
+    En zooms bajos solo vías principales y niveles altos (ver api/tiles.py).
+    Cacheado por corrida activa (ya comprimido); ETag/Last-Modified para revalidar (304).
+    """
+    if not tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="tile fuera de rango")
+    query = dict(hours=hours, tolerance_m=tolerance_m, use_hazard=use_hazard, min_mm=min_mm,
+                 only_cdmx=only_cdmx, mm_ref=mm_ref, weighted=weight_by_overlap)
+    key, headers, not_modified, snap = await revalidate(request, "tile", cache_control="public, max-age=300",
+                                                  z=z, x=x, y=y, **query)
+    if not_modified:
+        return not_modified
+
+    async def compute() -> bytes:
+        return await snap.read(tiles.render_tile, z, x, y, timeout_ms=TILE_TIMEOUT_MS,
+                               run_id=snap.run_id, **query) or b""
+
+    return await encoded_response(request, key, headers, compute, tile_cache,
+                                  media_type="application/vnd.mapbox-vector-tile")
+
+# ====================== POST /score/refresh ======================
+@router.post("/refresh")
+def score_refresh(
+    rebuild_cells: bool = Query(False, description="Rehace street_cells de la rejilla activa (tras recargar calles)"),
+    rebuild_hazard: bool = Query(False, description="Reconstruye street_hazard completo (tras recargar calles o polígonos)"),
+    rebuild_alcaldias: bool = Query(False, description="Reasigna alcaldía/in_cdmx de todas las calles (tras recargar alcaldías)"),
+):
+    """
+    Recalcula street_scores para la corrida activa.
+    Útil tras recargar calles o polígonos de riesgo sin una corrida nueva.
+    """
+    try:
+        with engine.begin() as conn:
+            run = runs.active_run(conn)
+            if rebuild_cells and run and run.get("grid_id"):
+                grids.build_street_cells(conn, run["grid_id"])
+            if rebuild_hazard:
+                enrich.refresh_flood_sub(conn)
+                hazard.refresh_street_hazard(conn)
+            if rebuild_alcaldias:
+                enrich.refresh_alcaldias_sub(conn)
+                enrich.assign_alcaldias(conn)
+            out = scoring.refresh_street_scores(conn)
+            # Misma corrida, datos derivados nuevos: cambia llaves/ETag en todos los workers
+            runs.mark_refreshed(conn)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"refresh falló: {e!r}")
+    # Libera la memoria de las entradas viejas en este worker
+    invalidate()
+    return {"ok": True, **out}
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Query
+from typing import Optional
+from ..db import run_read
+from .. import streets
+
+router = APIRouter(prefix="/streets", tags=["streets"])
+
+# ====================== /streets/search ======================
+@router.get("/search")
+async def streets_search(
+    q: str = Query(..., min_length=2, description="Nombre (o parte) de la calle; tolera acentos y typos"),
+    alcaldia: Optional[str] = Query(None, description="Alcaldía (se corrige por similitud)"),
+    limit: int = Query(10, ge=1, le=50),
+    hours: int = Query(72, ge=1, le=168),
+    tolerance_m: float = Query(0, ge=0, le=50),
+    use_hazard: bool = Query(True, description="Si False, ignora hazard"),
+    mm_ref: float = Query(80.0, gt=0, description="mm de referencia para normalizar (default 80)"),
+):
+    """
+    Calles cuyo nombre se parece a `q` (pg_trgm sobre calles.nombre_norm),
+    agrupadas por nombre + alcaldía, con su score actual.
+    """
+    def read(conn):
+        alc = (streets.match_alcaldia(conn, alcaldia) or alcaldia) if alcaldia else None
+        return alc, streets.search(conn, q, alcaldia=alc, limit=limit, hours=hours,
+                                   tolerance_m=tolerance_m, use_hazard=use_hazard, mm_ref=mm_ref)
+
+    alc, rows = await run_read(read)
+    return {"q": q, "alcaldia": alc, "results": rows}
@@ -1,5 +1,9 @@
+from datetime import datetime
 from fastapi import APIRouter
-from ..db import db_version
+from fastapi.responses import JSONResponse
+from ..db import run_read, db_version, pool_stats
+from ..cache import score_cache, tile_cache
+from .. import runs, scheduler
 
 router = APIRouter(prefix="/system", tags=["system"])
 
@@ -7,6 +11,30 @@ router = APIRouter(prefix="/system", tags=["system"])
 def health():
     return {"status": "ok"}
 
+@router.get("/ready")
+async def ready():
+    """
+    Readiness: 200 si hay una corrida de pronóstico activa, 503 si todavía no
+    (p. ej. la primera carga del scheduler sigue en curso) o si la base no responde.
+    """
+    try:
+        run = await run_read(runs.active_run)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"ready": False, "error": repr(e)})
+    body = {"ready": run is not None, "scheduler": scheduler.state()}
+    if run:
+        body["run_id"] = run["id"]
+        body["activated_at"] = run["activated_at"].isoformat() if run["activated_at"] else None
+        if run["activated_at"]:
+            body["age_s"] = round((datetime.utcnow() - run["activated_at"]).total_seconds())
+    return JSONResponse(status_code=200 if run else 503, content=body)
+
 @router.get("/db")
 def db_info():
-    return db_version()
+    """Versión de Postgres/PostGIS y, por engine (escritura, lecturas), estado del pool e histogramas de espera y latencia."""
+    return {**db_version(), "pools": pool_stats()}
+
+@router.get("/cache")
+def cache_stats():
+    """Aciertos/fallos de las cachés de respuestas de /score y de tiles."""
+    return {"score": score_cache.stats(), "tiles": tile_cache.stats()}
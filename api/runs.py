@@ -0,0 +1,142 @@
+# api/runs.py
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple
+from sqlalchemy import text
+from .db import engine
+
+# Corridas no activas que se conservan antes de podar
+KEEP_RUNS = 3
+# Filas de precip_forecast borradas por transacción al podar
+PRUNE_BATCH = 5000
+# Corridas en 'loading' más viejas que esto quedaron de un worker caído
+STALE_LOADING_MIN = 60
+
+_prune_lock = threading.Lock()
+
+# ======= Registro de corridas =======
+def create_run(
+    source: str,
+    window_from=None,
+    window_to=None,
+    series_start=None,
+    bbox: Optional[str] = None,
+    step_deg: Optional[float] = None,
+    grid_id: Optional[int] = None,
+) -> int:
+    """Registra una corrida en estado 'loading' (transacción propia) y devuelve su id."""
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO forecast_runs (source, window_from, window_to, series_start, bbox, step_deg, grid_id, status)
+            VALUES (:source, :wf, :wt, :ss, :bbox, :step, :grid, 'loading')
+            RETURNING id
+        """), {"source": source, "wf": window_from, "wt": window_to, "ss": series_start,
+               "bbox": bbox, "step": step_deg, "grid": grid_id}).scalar_one()
+
+def activate_run(conn, run_id: int, n_cells: int) -> None:
+    """
+    Marca la corrida como 'ready' y la vuelve la activa, desactivando la anterior.
+    Debe llamarse en la misma transacción que escribió las celdas: los lectores
+    ven la corrida vieja hasta el COMMIT y la nueva completa después.
+    """
+    # Serializa activaciones concurrentes (índice único parcial sobre is_active)
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('forecast_runs_active'))"))
+    conn.execute(text("""
+        UPDATE forecast_runs SET is_active = FALSE, status = 'superseded'
+        WHERE is_active AND id <> :id
+    """), {"id": run_id})
+    conn.execute(text("""
+        UPDATE forecast_runs
+        SET is_active = TRUE, status = 'ready', n_cells = :n, activated_at = (now() AT TIME ZONE 'utc')
+        WHERE id = :id
+    """), {"id": run_id, "n": n_cells})
+
+def fail_run(run_id: int, error: str) -> None:
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE forecast_runs SET status = 'failed', error = :err
+                WHERE id = :id AND NOT is_active
+            """), {"id": run_id, "err": error[:2000]})
+    except Exception as e:
+        print(f"[runs] no pude marcar la corrida {run_id} como fallida: {e!r}")
+
+def active_run_id(conn) -> Optional[int]:
+    return conn.execute(text("SELECT id FROM forecast_runs WHERE is_active")).scalar()
+
+def active_version(conn) -> Tuple[Optional[int], Optional[datetime]]:
+    """
+    (id de la corrida activa, refreshed_at): versión de los datos derivados.
+    Vive en la base, así que todos los workers ven el mismo valor.
+    """
+    row = conn.execute(text("SELECT id, refreshed_at FROM forecast_runs WHERE is_active")).first()
+    return (row[0], row[1]) if row else (None, None)
+
+def mark_refreshed(conn) -> None:
+    """Sella la corrida activa como recalculada; usar en la transacción que reescribió los derivados."""
+    conn.execute(text("""
+        UPDATE forecast_runs SET refreshed_at = (now() AT TIME ZONE 'utc')
+        WHERE is_active
+    """))
+
+def active_run(conn) -> Optional[Dict[str, Any]]:
+    row = conn.execute(text("""
+        SELECT id, source, issued_at, activated_at, refreshed_at, window_from, window_to,
+               series_start, bbox, step_deg, grid_id, status, n_cells
+        FROM forecast_runs WHERE is_active
+    """)).mappings().first()
+    return dict(row) if row else None
+
+# ======= Poda en segundo plano =======
+def prune_runs(keep: int = KEEP_RUNS, batch: int = PRUNE_BATCH,
+               stale_loading_min: int = STALE_LOADING_MIN) -> Dict[str, Any]:
+    """
+    Borra corridas viejas (no activas, más allá de las `keep` más recientes,
+    las fallidas y las que siguen en 'loading' tras `stale_loading_min`
+    minutos). Borra las celdas por lotes en transacciones cortas para no
+    bloquear a los lectores.
+    """
+    if not _prune_lock.acquire(blocking=False):
+        return {"skipped": True}
+    try:
+        with engine.connect() as conn:
+            old = conn.execute(text("""
+                SELECT id FROM forecast_runs
+                WHERE NOT is_active
+                  AND (status <> 'loading'
+                       OR issued_at < (now() AT TIME ZONE 'utc') - make_interval(mins => :stale))
+                  AND id NOT IN (
+                      SELECT id FROM forecast_runs
+                      WHERE NOT is_active AND status = 'superseded'
+                      ORDER BY id DESC LIMIT :keep
+                  )
+                ORDER BY id
+            """), {"keep": keep, "stale": stale_loading_min}).scalars().all()
+
+        cells = 0
+        for run_id in old:
+            while True:
+                with engine.begin() as conn:
+                    n = conn.execute(text("""
+                        DELETE FROM precip_forecast
+                        WHERE id IN (SELECT id FROM precip_forecast WHERE run_id = :r LIMIT :b)
+                    """), {"r": run_id, "b": batch}).rowcount or 0
+                cells += n
+                if n < batch:
+                    break
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM street_scores WHERE run_id = :r"), {"r": run_id})
+                conn.execute(text("DELETE FROM forecast_runs WHERE id = :r"), {"r": run_id})
+        return {"runs": len(old), "cells": cells}
+    finally:
+        _prune_lock.release()
+
+def prune_in_background() -> None:
+    def _job():
+        try:
+            out = prune_runs()
+            if out.get("runs"):
+                print(f"[runs] poda: {out}")
+        except Exception as e:
+            print(f"[runs] poda falló: {e!r}")
+    threading.Thread(target=_job, name="prune-runs", daemon=True).start()
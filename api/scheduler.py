@@ -0,0 +1,150 @@
+# api/scheduler.py
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import text
+from .db import engine
+from . import runs
+
+# Cada cuánto se pide un pronóstico nuevo a Open-Meteo (0 = desactivado)
+REFRESH_S = float(os.getenv("FORECAST_REFRESH_S", "3600"))
+# Desfase aleatorio ± para que varias instancias no peguen al mismo tiempo
+JITTER_S = float(os.getenv("FORECAST_REFRESH_JITTER_S", "300"))
+# Espera antes de la primera carga (deja que el servidor termine de levantar)
+STARTUP_DELAY_S = float(os.getenv("FORECAST_STARTUP_DELAY_S", "2"))
+# Reintento tras una falla o mientras no haya corrida activa: backoff exponencial
+# desde RETRY_MIN_S hasta RETRY_MAX_S (nunca más que REFRESH_S)
+RETRY_MIN_S = float(os.getenv("FORECAST_RETRY_MIN_S", "30"))
+RETRY_MAX_S = float(os.getenv("FORECAST_RETRY_MAX_S", "600"))
+# Rejilla que se carga (CDMX aprox, ~6 km)
+REFRESH_BBOX = os.getenv("FORECAST_BBOX", "-99.36,19.18,-98.94,19.59")
+REFRESH_STEP_DEG = float(os.getenv("FORECAST_STEP_DEG", "0.06"))
+REFRESH_HOURS = 72
+
+# Llave del advisory lock de sesión: una sola instancia ingiere a la vez
+LOCK_NAME = "forecast_refresh"
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_state: Dict[str, Any] = {
+    "enabled": REFRESH_S > 0,
+    "running": False,
+    "last_attempt": None,
+    "last_ok": None,
+    "last_run_id": None,
+    "last_error": None,
+    "last_skip": None,
+    "failures": 0,
+    "next_at": None,
+}
+
+def state() -> Dict[str, Any]:
+    return dict(_state)
+
+def _due(conn) -> bool:
+    """¿Hace falta una corrida nueva? (otra instancia pudo haberla cargado hace poco)."""
+    run = runs.active_run(conn)
+    if not run or not run.get("activated_at"):
+        return True
+    age_s = (datetime.utcnow() - run["activated_at"]).total_seconds()
+    return age_s >= REFRESH_S / 2
+
+def _post_ingest(conn) -> None:
+    """
+    Tras activar: estadísticas del planner al día para las tablas que acaban
+    de recibir miles de filas (street_scores ya se recalculó en la misma
+    transacción que activó la corrida).
+    """
+    conn.execute(text("ANALYZE precip_forecast"))
+    conn.execute(text("ANALYZE street_scores"))
+
+def refresh_once(force: bool = False) -> Dict[str, Any]:
+    """
+    Carga una corrida de Open-Meteo si ninguna otra instancia lo está haciendo
+    (pg_try_advisory_lock) y si la activa ya no es reciente (salvo `force`).
+    """
+    from .routers.forecast import OpenMeteoReq, load_openmeteo
+
+    with engine.connect() as lock_conn:
+        got = lock_conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:k))"), {"k": LOCK_NAME}).scalar()
+        lock_conn.commit()  # el lock es de sesión; no dejar la conexión "idle in transaction"
+        if not got:
+            return {"skipped": "otra instancia está cargando"}
+        try:
+            if not force and not _due(lock_conn):
+                lock_conn.commit()
+                return {"skipped": "corrida activa reciente"}
+            lock_conn.commit()
+            _state["running"] = True
+            req = OpenMeteoReq(bbox=REFRESH_BBOX, step_deg=REFRESH_STEP_DEG,
+                               hours=REFRESH_HOURS, clear_previous=True)
+            out = load_openmeteo(req)
+            with engine.begin() as conn:
+                _post_ingest(conn)
+            return {"run_id": out["run_id"], "inserted": out["inserted"]}
+        finally:
+            _state["running"] = False
+            lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext(:k))"), {"k": LOCK_NAME})
+            lock_conn.commit()
+
+def _next_delay() -> float:
+    return max(60.0, REFRESH_S + random.uniform(-JITTER_S, JITTER_S))
+
+def _retry_delay(failures: int) -> float:
+    """Backoff exponencial con jitter (±20 %) para el intento número `failures`."""
+    base = min(RETRY_MIN_S * 2 ** max(0, failures - 1), RETRY_MAX_S, REFRESH_S)
+    return base * random.uniform(0.8, 1.2)
+
+def _has_active_run() -> bool:
+    try:
+        with engine.connect() as conn:
+            return runs.active_run_id(conn) is not None
+    except Exception:
+        return False
+
+def _loop() -> None:
+    delay = STARTUP_DELAY_S + random.uniform(0, min(JITTER_S, 10.0))
+    while True:
+        _state["next_at"] = (datetime.utcnow() + timedelta(seconds=delay)).isoformat()
+        if _stop.wait(delay):
+            return
+        _state["last_attempt"] = datetime.utcnow().isoformat()
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            out = refresh_once()
+            if "skipped" in out:
+                _state["last_skip"] = out["skipped"]
+                # Otra instancia cargando sin corrida activa todavía: revisar pronto
+                ok = _has_active_run()
+            else:
+                _state["last_ok"] = datetime.utcnow().isoformat()
+                _state["last_run_id"] = out["run_id"]
+                _state["last_error"] = None
+                ok = True
+                print(f"[scheduler] corrida {out['run_id']} cargada en {time.perf_counter() - t0:.1f} s")
+        except Exception as e:
+            # HTTPException de load_openmeteo incluida: se reintenta con backoff
+            _state["last_error"] = repr(e)
+            print(f"[scheduler] carga falló: {e!r}")
+        if ok:
+            _state["failures"] = 0
+            delay = _next_delay()
+        else:
+            _state["failures"] += 1
+            delay = _retry_delay(_state["failures"])
+
+def start() -> None:
+    """Lanza el ciclo de refresco en un hilo daemon (no bloquea el arranque)."""
+    global _thread
+    if REFRESH_S <= 0 or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="forecast-refresh", daemon=True)
+    _thread.start()
+
+def stop() -> None:
+    _stop.set()
@@ -0,0 +1,566 @@
+# api/scoring.py
+import re
+import unicodedata
+from typing import Optional, Dict, Any, Tuple, List, Iterator, AsyncIterator
+from sqlalchemy import text
+from .grids import MAX_TOL_M
+
+# Tolerancias (m) que se precalculan en street_scores tras cada corrida.
+# Otras tolerancias se calculan al vuelo (street_cells o join espacial completo).
+SCORE_TOLERANCES = (0.0, 5.0, 10.0, 25.0, 50.0)
+# Ventanas (h) que street_scores guarda como escalares (mm_{h}h, mmw_{h}h, peak_{h}h);
+# otras ventanas salen de las series prefijas de las celdas al consultar
+SCORE_WINDOWS = (6, 24, 72, 168)
+
+# Niveles válidos (mismos umbrales que score_query)
+NIVELES = ("Alto", "Medio", "Bajo")
+
+# ======= Comparación de texto sin acentos =======
+def fold(s: Optional[str]) -> str:
+    """minúsculas, sin acentos y con espacios colapsados (como calles.nombre_norm)."""
+    s = "".join(c for c in unicodedata.normalize("NFD", s or "") if unicodedata.category(c) != "Mn")
+    return re.sub(r"\s+", " ", s.lower().strip())
+
+def like_pattern(term: str) -> str:
+    """'%term%' plegado y con comodines escapados."""
+    t = fold(term).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{t}%"
+
+# ======= Fragmentos SQL compartidos =======
+def window_at(arr: str) -> str:
+    """
+    Valor de una serie prefija (mm_cum / peak_cum) a las :hours horas: O(1) por fila.
+    La serie se satura en su último valor si la ventana es más larga.
+    """
+    return f"{arr}[LEAST(:hours, cardinality({arr}))]"
+
+def window_col(prefix: str) -> str:
+    """Columna escalar de street_scores para la ventana :hours (una de SCORE_WINDOWS)."""
+    whens = " ".join(f"WHEN {h} THEN {prefix}_{h}h" for h in SCORE_WINDOWS)
+    return f"(CASE :hours {whens} END)"
+
+def cells_join(run: str, grid: str) -> str:
+    """
+    Calle (alias c) -> celdas de la rejilla vía street_cells -> precip_forecast
+    de la corrida (alias p), con la tolerancia :tol_m. Lookup por cell_idx, sin join espacial.
+    """
+    return f"""
+        LEFT JOIN street_cells sc
+               ON sc.calle_id = c.id AND sc.grid_id = {grid} AND sc.dist_m <= :tol_m
+        LEFT JOIN precip_forecast p
+               ON p.run_id = {run} AND p.cell_idx = sc.cell_idx
+    """
+
+# Fracción de la longitud de la calle dentro de la celda (para ponderar lluvia)
+OVERLAP_FRAC = "COALESCE(ST_Length(ST_Intersection(c.geom, p.geom)) / NULLIF(ST_Length(c.geom), 0), 0)"
+
+def metric_join(tolerance_m: float) -> str:
+    """
+    Condición calle↔celda. Con tolerancia usa las columnas proyectadas geom_m
+    (UTM 14N, metros) para que ST_DWithin use su índice GiST.
+    """
+    if tolerance_m > 0:
+        return "ST_DWithin(c.geom_m, p.geom_m, :tol_m)"
+    return "(c.geom && p.geom AND ST_Intersects(c.geom, p.geom))"
+
+def hazard_expr(tolerance_m: float, use_hazard: bool = True) -> str:
+    """
+    Hazard por calle. Para las tolerancias de SCORE_TOLERANCES es un lookup en
+    street_hazard (precalculado al cargar polígonos); para otras, EXISTS contra
+    los pedazos de flood_polygons_sub (ST_DWithin indexado sobre geom_m).
+    """
+    if not use_hazard:
+        return "FALSE"
+    if float(tolerance_m) in SCORE_TOLERANCES:
+        return "EXISTS (SELECT 1 FROM street_hazard h WHERE h.calle_id = c.id AND h.tol_m = :tol_m)"
+    if tolerance_m > 0:
+        return (
+            "EXISTS (SELECT 1 FROM flood_polygons_sub f "
+            "        WHERE ST_DWithin(c.geom_m, f.geom_m, :tol_m))"
+        )
+    return (
+        "EXISTS (SELECT 1 FROM flood_polygons_sub f "
+        "        WHERE c.geom && f.geom "
+        "          AND ST_Intersects(c.geom, f.geom))"
+    )
+
+def street_filters(
+    bbox: Optional[str],
+    only_cdmx: bool,
+    alcaldia: Optional[str] = None,
+    name_terms: Optional[List[str]] = None,
+    calle_ids: Optional[List[int]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Filtros sobre calles (alias c). Devuelve (sql_extra, params).
+    only_cdmx y alcaldia (nombre exacto, ver streets.match_alcaldia) usan las
+    columnas que asigna enrich.assign_alcaldias; name_terms compara por subcadena
+    sin acentos (todas las palabras) sobre calles.nombre_norm y su índice trigram.
+    Lanza ValueError si bbox no es 'minx,miny,maxx,maxy'.
+    """
+    where_extra = ""
+    params: Dict[str, Any] = {}
+    if bbox:
+        minx, miny, maxx, maxy = [float(x) for x in bbox.split(",")]
+        where_extra += " AND ST_Intersects(c.geom, ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326))"
+        params.update({"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy})
+    if only_cdmx:
+        where_extra += " AND c.in_cdmx"
+    if alcaldia:
+        where_extra += " AND c.alcaldia = :alcaldia"
+        params["alcaldia"] = alcaldia
+    if name_terms:
+        where_extra += " AND c.nombre_norm LIKE ALL(:name_likes)"
+        params["name_likes"] = [like_pattern(t) for t in name_terms]
+    if calle_ids is not None:
+        where_extra += " AND c.id = ANY(:calle_ids)"
+        params["calle_ids"] = list(calle_ids)
+    return where_extra, params
+
+# ======= Tabla materializada street_scores =======
+def refresh_street_scores(
+    conn,
+    run_id=None,
+    tolerances=SCORE_TOLERANCES,
+    calle_ids: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """
+    Recalcula street_scores para la corrida run_id (default: la corrida activa).
+    Guarda por calle y tolerancia, solo para las ventanas de SCORE_WINDOWS, la
+    lluvia acumulada (simple y ponderada) y el pico horario como escalares,
+    leídos de las series prefijas de sus celdas (O(1) por celda y ventana);
+    mm_ref se resuelve al consultar y el hazard sale de street_hazard.
+    Con `calle_ids` solo rehace esas calles. Usa la transacción de `conn`.
+    """
+    if run_id is None:
+        run_id = conn.execute(text("SELECT id FROM forecast_runs WHERE is_active")).scalar()
+    if run_id is None:
+        return {"run_id": None, "rows": 0}
+
+    # Si la corrida es una rejilla con street_cells ya calculado: lookup por cell_idx
+    grid_id = conn.execute(text("""
+        SELECT g.id FROM forecast_runs r JOIN forecast_grids g ON g.id = r.grid_id
+        WHERE r.id = :r AND g.built_at IS NOT NULL
+    """), {"r": run_id}).scalar()
+
+    only = "WHERE c.id = ANY(:ids)" if calle_ids is not None else ""
+    if calle_ids is not None:
+        conn.execute(text("DELETE FROM street_scores WHERE run_id = :r AND calle_id = ANY(:ids)"),
+                     {"r": run_id, "ids": calle_ids})
+    else:
+        conn.execute(text("DELETE FROM street_scores WHERE run_id = :r"), {"r": run_id})
+
+    def at(arr: str, h: int) -> str:
+        return f"{arr}[LEAST({h}, cardinality({arr}))]"
+
+    columns = ", ".join(f"{k}_{h}h" for k in ("mm", "mmw", "peak") for h in SCORE_WINDOWS)
+    total = 0
+    for tol in tolerances:
+        if grid_id is not None:
+            source = cells_join(":r", ":g")
+            frac = "sc.overlap_frac"
+        else:
+            source = f"""
+                LEFT JOIN (
+                    SELECT id, mm_cum, peak_cum, geom, geom_m FROM precip_forecast WHERE run_id = :r
+                ) p ON {metric_join(tol)}
+            """
+            frac = OVERLAP_FRAC
+        aggs = ",\n                ".join(
+            [f"SUM({at('p.mm_cum', h)})" for h in SCORE_WINDOWS]
+            + [f"SUM({at('p.mm_cum', h)} * ({frac}))" for h in SCORE_WINDOWS]
+            + [f"MAX({at('p.peak_cum', h)})" for h in SCORE_WINDOWS]
+        )
+        sql = text(f"""
+            INSERT INTO street_scores (run_id, tol_m, calle_id, {columns})
+            SELECT
+                :r, :tol_m, c.id,
+                {aggs}
+            FROM calles c
+            {source}
+            {only}
+            GROUP BY c.id
+        """)
+        total += conn.execute(sql, {"r": run_id, "g": grid_id, "tol_m": tol, "ids": calle_ids}).rowcount or 0
+
+    return {"run_id": run_id, "grid_id": grid_id, "rows": total, "tolerances": list(tolerances)}
+
+def active_run_id(conn) -> Optional[int]:
+    return conn.execute(text("SELECT id FROM forecast_runs WHERE is_active")).scalar()
+
+def read_plan(conn, hours: int, tolerance_m: float, run_id: Optional[int]) -> Tuple[str, Optional[int]]:
+    """
+    Cómo leer la lluvia por calle de la corrida run_id. Devuelve (plan, grid_id):
+    "scores" si street_scores tiene esa ventana y tolerancia (lookup escalar),
+    "cells" si la corrida es una rejilla con street_cells (series prefijas de
+    sus celdas, O(1) por celda) y si no "spatial" (join espacial completo).
+    """
+    if run_id is None:
+        return "spatial", None
+    row = conn.execute(text("""
+        SELECT g.id AS grid_id,
+               EXISTS (SELECT 1 FROM street_scores s WHERE s.run_id = r.id AND s.tol_m = :tol_m) AS scored
+        FROM forecast_runs r
+        LEFT JOIN forecast_grids g ON g.id = r.grid_id AND g.built_at IS NOT NULL
+        WHERE r.id = :r
+    """), {"r": run_id, "tol_m": float(tolerance_m)}).mappings().first()
+    if row is None:
+        return "spatial", None
+    if hours in SCORE_WINDOWS and float(tolerance_m) in SCORE_TOLERANCES and row["scored"]:
+        return "scores", row["grid_id"]
+    if row["grid_id"] is not None and tolerance_m <= MAX_TOL_M:
+        return "cells", row["grid_id"]
+    return "spatial", None
+
+# ======= Geometrías simplificadas =======
+# Tolerancias (m) de las columnas precalculadas calles.geom_s{N} (ver db/init)
+SIMPLIFY_LEVELS = (5, 20, 80)
+# Metros por pixel en zoom 0 a la latitud de CDMX (256 px por tile)
+M_PER_PX_Z0 = 156543.03 * 0.9432
+
+def zoom_simplify_m(zoom: int) -> float:
+    """Tolerancia equivalente a un pixel en ese zoom de Web Mercator."""
+    return M_PER_PX_Z0 / (2 ** zoom)
+
+def geom_column(simplify_m: float = 0.0) -> str:
+    """Columna precalculada más simplificada que no exceda `simplify_m`; c.geom si ninguna."""
+    fits = [lvl for lvl in SIMPLIFY_LEVELS if lvl <= (simplify_m or 0)]
+    return f"c.geom_s{max(fits)}" if fits else "c.geom"
+
+# ======= Consulta de score =======
+# Feature GeoJSON armado en PostGIS como texto (sin objetos intermedios en Python).
+# Calle sin geometría -> "geometry":null (como el modo sin stream), nunca un feature NULL
+FEATURE_TEXT = """
+    '{"type":"Feature","geometry":' || COALESCE(ST_AsGeoJSON(geom, :precision), 'null') || ',"properties":' ||
+    json_build_object('nombre', nombre, 'alcaldia', alcaldia, 'p72_mm', p72_mm,
+                      'peak_mm_h', peak_mm_h, 'hazard', hazard, 'score', score, 'nivel', nivel)::text
+    || '}' AS feature
+"""
+
+def scored_sql(
+    tolerance_m: float,
+    use_hazard: bool,
+    where_extra: str,
+    plan: str,
+    weighted: bool = False,
+    geom_col: str = "c.geom",
+) -> str:
+    """
+    CTEs agg/scored: lluvia, hazard, score y nivel por calle (sin ordenar ni limitar).
+    `plan` es el de read_plan; `geom_col` la geometría que se expone como `geom` (ver geom_column).
+    """
+    hazard = f"CASE WHEN {hazard_expr(tolerance_m, use_hazard)} THEN 1.0::float8 ELSE 0.0::float8 END AS hazard"
+
+    if plan == "scores":
+        mm_col = window_col("s.mmw" if weighted else "s.mm")
+        base = f"""
+            SELECT
+                c.nombre, c.alcaldia, c.highway, {geom_col} AS geom,
+                COALESCE({mm_col}, 0) AS p72_mm,
+                {window_col("s.peak")} AS peak_mm_h,
+                {hazard}
+            FROM street_scores s
+            JOIN calles c ON c.id = s.calle_id
+            WHERE s.run_id = :run_id AND s.tol_m = :tol_m
+              AND COALESCE({mm_col}, 0) >= :min_mm {where_extra}
+        """
+    else:
+        if plan == "cells":
+            cte, source, frac = "", cells_join(":run_id", ":grid_id"), "sc.overlap_frac"
+        else:
+            cte = """
+                WITH p AS (
+                    SELECT id, mm_cum, peak_cum, geom, geom_m
+                    FROM precip_forecast
+                    WHERE run_id = :run_id
+                )
+            """
+            source, frac = f"LEFT JOIN p ON {metric_join(tolerance_m)}", OVERLAP_FRAC
+        cell_mm = f"{window_at('p.mm_cum')} * {frac}" if weighted else window_at("p.mm_cum")
+        base = f"""
+            {cte}
+            SELECT
+                c.nombre, c.alcaldia, c.highway, {geom_col} AS geom,
+                COALESCE(SUM({cell_mm}), 0) AS p72_mm,
+                MAX({window_at("p.peak_cum")}) AS peak_mm_h,
+                {hazard}
+            FROM calles c
+            {source}
+            WHERE 1=1 {where_extra}
+            GROUP BY c.id, c.nombre, c.alcaldia, c.highway, {geom_col}
+            HAVING COALESCE(SUM({cell_mm}), 0) >= :min_mm
+        """
+
+    return f"""
+        WITH agg AS ({base}),
+        base_score AS (
+            SELECT
+                nombre, alcaldia, highway, geom, p72_mm, peak_mm_h, hazard,
+                0.3*hazard + 0.7*LEAST(1, p72_mm/:mm_ref) AS score
+            FROM agg
+        ),
+        scored AS (
+            SELECT *,
+                CASE
+                    WHEN score >= 0.70 THEN 'Alto'
+                    WHEN score >= 0.30 THEN 'Medio'
+                    ELSE 'Bajo'
+                END AS nivel
+            FROM base_score
+        )
+    """
+
+def score_query(
+    tolerance_m: float,
+    use_hazard: bool,
+    where_extra: str,
+    plan: str,
+    with_geom: bool = False,
+    weighted: bool = False,
+    by_nivel: bool = False,
+    ascending: bool = False,
+    distinct: bool = False,
+    as_feature: bool = False,
+    geom_col: str = "c.geom",
+):
+    """
+    SQL de ranking por calle según `plan` (read_plan): lookup en street_scores,
+    street_cells + series de las celdas, o join espacial completo.
+    p72_mm es la lluvia acumulada en las primeras :hours horas de la corrida;
+    con `weighted`, cada celda pesa según la fracción de la calle que cae en ella.
+    score = 0.3*hazard + 0.7*min(1, p72/mm_ref)
+    by_nivel filtra por :nivel; distinct deja un tramo (el de mayor score) por nombre+alcaldía.
+    as_feature devuelve una sola columna `feature`: el Feature GeoJSON ya como texto;
+    la geometría sale de `geom_col` con :precision decimales.
+    """
+    geom_json = ", ST_AsGeoJSON(geom, :precision)::json AS geom_json" if with_geom else ""
+    columns = f"nombre, alcaldia, p72_mm, peak_mm_h, hazard, score, nivel{geom_json}"
+    if as_feature:
+        columns = FEATURE_TEXT
+    source = "scored"
+    if distinct:
+        source = "(SELECT DISTINCT ON (nombre, alcaldia) * FROM scored ORDER BY nombre, alcaldia, score DESC) d"
+    where = "WHERE nivel = :nivel" if by_nivel else ""
+
+    return text(f"""
+        {scored_sql(tolerance_m, use_hazard, where_extra, plan, weighted, geom_col)}
+        SELECT {columns}
+        FROM {source}
+        {where}
+        ORDER BY score {"ASC" if ascending else "DESC"}
+        LIMIT :top_k
+    """)
+
+def stats_query(
+    tolerance_m: float,
+    use_hazard: bool,
+    where_extra: str,
+    plan: str,
+    weighted: bool = False,
+    by_alcaldia: bool = False,
+):
+    """
+    Agregados sobre las calles filtradas (conteos por nivel, promedio, máximo y
+    percentiles 50/90 de score y p72_mm).
+    Con `by_alcaldia` agrupa por alcaldía (solo grupos con >= :min_rows calles),
+    ordenado por calles en nivel Alto y score promedio, limitado a :top_k (NULL = todas).
+    """
+    group = "alcaldia," if by_alcaldia else ""
+    tail = """
+        WHERE alcaldia IS NOT NULL
+        GROUP BY alcaldia
+        HAVING COUNT(*) >= :min_rows
+        ORDER BY n_alto DESC, score_avg DESC
+        LIMIT :top_k
+    """ if by_alcaldia else ""
+
+    return text(f"""
+        {scored_sql(tolerance_m, use_hazard, where_extra, plan, weighted)}
+        SELECT {group}
+            COUNT(*)::int AS n,
+            COUNT(*) FILTER (WHERE nivel = 'Alto')::int AS n_alto,
+            COUNT(*) FILTER (WHERE nivel = 'Medio')::int AS n_medio,
+            COUNT(*) FILTER (WHERE nivel = 'Bajo')::int AS n_bajo,
+            AVG(score)::float AS score_avg,
+            MAX(score)::float AS score_max,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY score)::float AS score_p50,
+            percentile_cont(0.9) WITHIN GROUP (ORDER BY score)::float AS score_p90,
+            AVG(p72_mm)::float AS p72_avg_mm,
+            MIN(p72_mm)::float AS p72_min_mm,
+            MAX(p72_mm)::float AS p72_max_mm,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY p72_mm)::float AS p72_p50_mm,
+            percentile_cont(0.9) WITHIN GROUP (ORDER BY p72_mm)::float AS p72_p90_mm
+        FROM scored
+        {tail}
+    """)
+
+# ======= Servicio (routers y chat) =======
+def query_params(
+    conn,
+    hours: int,
+    tolerance_m: float,
+    use_hazard: bool,
+    min_mm: float,
+    mm_ref: float,
+    bbox: Optional[str],
+    only_cdmx: bool,
+    alcaldia: Optional[str],
+    name_terms: Optional[List[str]],
+    calle_ids: Optional[List[int]] = None,
+    run_id: Optional[int] = None,
+) -> Tuple[str, Dict[str, Any], str]:
+    """
+    (where_extra, params, plan) para scored_sql sobre la corrida run_id
+    (default: la activa). Quien ya fijó la corrida (llave de caché/ETag) la pasa
+    explícita para que el cuerpo sea de esa misma corrida.
+    """
+    where_extra, params = street_filters(bbox, only_cdmx, alcaldia=alcaldia, name_terms=name_terms,
+                                         calle_ids=calle_ids)
+    if run_id is None:
+        run_id = active_run_id(conn)
+    plan, grid_id = read_plan(conn, hours, tolerance_m, run_id)
+    params.update({"hours": hours, "tol_m": tolerance_m, "min_mm": min_mm, "mm_ref": mm_ref,
+                   "run_id": run_id, "grid_id": grid_id})
+    return where_extra, params, plan
+
+def score_statement(
+    conn,
+    hours: int = 72,
+    top_k: int = 10,
+    tolerance_m: float = 0.0,
+    use_hazard: bool = True,
+    min_mm: float = 0.0,
+    mm_ref: float = 80.0,
+    bbox: Optional[str] = None,
+    only_cdmx: bool = False,
+    weighted: bool = False,
+    alcaldia: Optional[str] = None,
+    nivel: Optional[str] = None,
+    name_terms: Optional[List[str]] = None,
+    calle_ids: Optional[List[int]] = None,
+    ascending: bool = False,
+    distinct: bool = False,
+    with_geom: bool = False,
+    as_feature: bool = False,
+    simplify_m: float = 0.0,
+    precision: int = 9,
+    run_id: Optional[int] = None,
+):
+    """
+    (sql, params) del ranking de calles de la corrida run_id (default: la activa) con todos los filtros en SQL.
+    Con geometría, `simplify_m` elige la columna presimplificada y `precision`
+    los decimales de ST_AsGeoJSON. Lanza ValueError si bbox o nivel son inválidos.
+    """
+    if nivel is not None and nivel.capitalize() not in NIVELES:
+        raise ValueError(f"nivel inválido: {nivel}")
+    where_extra, params, plan = query_params(
+        conn, hours, tolerance_m, use_hazard, min_mm, mm_ref, bbox, only_cdmx, alcaldia, name_terms, calle_ids,
+        run_id)
+    params.update({"top_k": top_k, "nivel": nivel.capitalize() if nivel else None, "precision": precision})
+    sql = score_query(tolerance_m, use_hazard, where_extra, plan, with_geom=with_geom,
+                      weighted=weighted, by_nivel=nivel is not None, ascending=ascending, distinct=distinct,
+                      as_feature=as_feature, geom_col=geom_column(simplify_m))
+    return sql, params
+
+def score_rows(conn, **query) -> List[Dict[str, Any]]:
+    """Ranking de calles como dicts; parámetros de score_statement."""
+    sql, params = score_statement(conn, **query)
+    return [dict(r) for r in conn.execute(sql, params).mappings().all()]
+
+def iter_features(conn, batch_rows: int = 1000, **query) -> Iterator[str]:
+    """
+    Features GeoJSON (texto) del ranking, leídos con cursor del lado del servidor
+    en lotes de `batch_rows`: memoria constante sin importar top_k.
+    """
+    sql, params = score_statement(conn, as_feature=True, **query)
+    result = conn.execution_options(stream_results=True, max_row_buffer=batch_rows).execute(sql, params)
+    for rows in result.scalars().partitions(batch_rows):
+        yield from rows
+
+async def aiter_features(aconn, batch_rows: int = 1000, **query) -> AsyncIterator[str]:
+    """iter_features sobre una AsyncConnection (conn.stream: cursor del lado del servidor)."""
+    sql, params = await aconn.run_sync(lambda conn: score_statement(conn, as_feature=True, **query))
+    result = await aconn.stream(sql, params, execution_options={"max_row_buffer": batch_rows})
+    async for rows in result.scalars().partitions(batch_rows):
+        for row in rows:
+            yield row
+
+def score_stats(
+    conn,
+    hours: int = 72,
+    tolerance_m: float = 0.0,
+    use_hazard: bool = True,
+    min_mm: float = 0.0,
+    mm_ref: float = 80.0,
+    bbox: Optional[str] = None,
+    only_cdmx: bool = False,
+    weighted: bool = False,
+    alcaldia: Optional[str] = None,
+    by_alcaldia: bool = False,
+    min_rows: int = 1,
+    top_k: Optional[int] = None,
+    run_id: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Agregados (total o por alcaldía) de las calles filtradas; ver stats_query."""
+    where_extra, params, plan = query_params(
+        conn, hours, tolerance_m, use_hazard, min_mm, mm_ref, bbox, only_cdmx, alcaldia, None, run_id=run_id)
+    params.update({"min_rows": min_rows, "top_k": top_k})
+    sql = stats_query(tolerance_m, use_hazard, where_extra, plan,
+                      weighted=weighted, by_alcaldia=by_alcaldia)
+    return [dict(r) for r in conn.execute(sql, params).mappings().all()]
+
+def alcaldia_summary(conn, run_id: Optional[int] = None, **query) -> Dict[str, Any]:
+    """
+    Estadísticas de todas las alcaldías (payload de /score/alcaldias) de la
+    corrida run_id (default: la activa). Cacheable por corrida: el chat guarda
+    el dict y el endpoint los bytes codificados.
+    """
+    if run_id is None:
+        run_id = active_run_id(conn)
+    rows = score_stats(conn, by_alcaldia=True, run_id=run_id, **query)
+    return {"run_id": run_id, "hours": query.get("hours", 72), "alcaldias": rows}
+
+# ======= Resumen de la corrida activa =======
+def forecast_summary(conn, from_hours: int, to_hours: int, bbox: Optional[str] = None,
+                     windows=(6, 24, 72, 168)) -> Dict[str, Any]:
+    """
+    Conteo de celdas de la corrida activa, suma de mm y pico horario entre las
+    horas from_hours y to_hours, y acumulados por ventana. Usa las sumas prefijas
+    (mm_cum) de cada celda: O(1) por celda y ventana (el pico es O(horas) cuando
+    from_hours > 0).
+    Lanza ValueError si bbox no es 'minx,miny,maxx,maxy'.
+    """
+    def cum_at(h: str) -> str:
+        return f"mm_cum[LEAST({h}, cardinality(mm_cum))]"
+
+    cols = ",\n".join(
+        f"COALESCE(SUM({cum_at(str(h))}),0)::float AS mm_{h}h" for h in windows
+    )
+    # Pico horario dentro de (t0, t1]: desde la hora 0 basta peak_cum (O(1));
+    # si no, máximo de mm_cum[h] - mm_cum[h-1] sobre las horas de la ventana
+    peak_sql = f"""CASE WHEN :t0 <= 0 AND peak_cum IS NOT NULL
+                      THEN peak_cum[LEAST(:t1, cardinality(peak_cum))]
+                      ELSE (SELECT MAX(mm_cum[h] - COALESCE(mm_cum[h - 1], 0))
+                            FROM generate_series(GREATEST(:t0, 0) + 1, LEAST(:t1, cardinality(mm_cum))) AS h)
+                 END"""
+    base = f"""
+        SELECT COUNT(*)::int AS n_cells,
+               COALESCE(SUM({cum_at(':t1')} - CASE WHEN :t0 > 0 THEN {cum_at(':t0')} ELSE 0 END),0)::float AS mm_sum,
+               MAX({peak_sql})::float AS peak_mm_h,
+               {cols}
+        FROM precip_forecast
+        WHERE run_id = (SELECT id FROM forecast_runs WHERE is_active)
+    """
+    params: Dict[str, Any] = {"t0": from_hours, "t1": to_hours}
+    if bbox:
+        minx, miny, maxx, maxy = [float(x) for x in bbox.split(",")]
+        base += " AND ST_Intersects(geom, ST_MakeEnvelope(:minx,:miny,:maxx,:maxy,4326))"
+        params.update({"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy})
+
+    row = conn.execute(text(base), params).mappings().first()
+    return {
+        "n_cells": row["n_cells"],
+        "mm_sum": row["mm_sum"],
+        "peak_mm_h": row["peak_mm_h"],
+        "windows_mm": {f"{h}h": row[f"mm_{h}h"] for h in windows},
+    }
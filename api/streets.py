@@ -0,0 +1,89 @@
+# api/streets.py
+from typing import Optional, Dict, Any, List
+from sqlalchemy import text
+from . import scoring
+
+# word_similarity mínima (pg_trgm) para aceptar una calle como candidata
+SEARCH_THRESHOLD = 0.45
+# similarity mínima para corregir un nombre de alcaldía con typos
+ALCALDIA_THRESHOLD = 0.35
+# Nombres candidatos (nombre + alcaldía) que se puntúan por búsqueda
+MAX_CANDIDATES = 200
+
+def match_alcaldia(conn, name: Optional[str]) -> Optional[str]:
+    """
+    Nombre oficial (tabla alcaldias) más parecido a `name`, tolerando typos y
+    acentos ("iztapalpa", "cuahutemoc"). None si nada pasa ALCALDIA_THRESHOLD.
+    """
+    t = scoring.fold(name)
+    if not t:
+        return None
+    return conn.execute(text("""
+        SELECT nombre
+        FROM alcaldias
+        WHERE GREATEST(similarity(nombre_norm, :t), word_similarity(:t, nombre_norm)) >= :th
+        ORDER BY GREATEST(similarity(nombre_norm, :t), word_similarity(:t, nombre_norm)) DESC
+        LIMIT 1
+    """), {"t": t, "th": ALCALDIA_THRESHOLD}).scalar()
+
+def search(
+    conn,
+    q: str,
+    alcaldia: Optional[str] = None,
+    limit: int = 10,
+    **score_opts,
+) -> List[Dict[str, Any]]:
+    """
+    Búsqueda difusa de calles por nombre sobre calles.nombre_norm (índice GIN
+    pg_trgm): subcadena o word_similarity >= SEARCH_THRESHOLD; `alcaldia` es el
+    nombre exacto (ver match_alcaldia). Agrupa los tramos
+    por nombre + alcaldía y les pega el score actual (el tramo con mayor score);
+    `score_opts` son los parámetros de scoring.score_rows (hours, tolerance_m, ...).
+    Ordena por similitud y luego por score.
+    """
+    t = scoring.fold(q)
+    if not t:
+        return []
+
+    params: Dict[str, Any] = {"t": t, "like": scoring.like_pattern(q), "n": MAX_CANDIDATES,
+                              "th": str(SEARCH_THRESHOLD)}
+    alc_sql = ""
+    if alcaldia:
+        alc_sql = "AND c.alcaldia = :alcaldia"
+        params["alcaldia"] = alcaldia
+
+    # Umbral del operador <% solo para esta transacción
+    conn.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :th, true)"), params)
+    cands = conn.execute(text(f"""
+        SELECT c.nombre, c.alcaldia, array_agg(c.id) AS ids,
+               MAX(CASE WHEN c.nombre_norm LIKE :like THEN 1.0
+                        ELSE word_similarity(:t, c.nombre_norm) END)::float AS similarity
+        FROM calles c
+        WHERE (c.nombre_norm LIKE :like OR :t <% c.nombre_norm) {alc_sql}
+        GROUP BY c.nombre, c.alcaldia
+        ORDER BY similarity DESC
+        LIMIT :n
+    """), params).mappings().all()
+    if not cands:
+        return []
+
+    ids = [i for c in cands for i in c["ids"]]
+    scored = scoring.score_rows(conn, calle_ids=ids, top_k=len(ids), distinct=True, **score_opts)
+    by_name = {(r["nombre"], r["alcaldia"]): r for r in scored}
+
+    out = []
+    for c in cands:
+        r = by_name.get((c["nombre"], c["alcaldia"]), {})
+        out.append({
+            "nombre": c["nombre"],
+            "alcaldia": c["alcaldia"],
+            "similarity": round(c["similarity"], 3),
+            "tramos": len(c["ids"]),
+            "p72_mm": r.get("p72_mm"),
+            "peak_mm_h": r.get("peak_mm_h"),
+            "hazard": r.get("hazard"),
+            "score": r.get("score"),
+            "nivel": r.get("nivel"),
+        })
+    out.sort(key=lambda x: (x["similarity"], x["score"] or 0.0), reverse=True)
+    return out[:limit]
@@ -0,0 +1,83 @@
+# api/tiles.py
+from typing import Optional
+from sqlalchemy import text
+from . import scoring
+
+# Resolución y margen (en unidades de tile) de ST_AsMVTGeom
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+# Ancho del mundo en Web Mercator (m)
+WORLD_M = 40075016.68557849
+
+# Clases de vía OSM que se dibujan en zooms bajos
+MAJOR_ROADS = ("motorway", "trunk", "primary")
+MEDIUM_ROADS = MAJOR_ROADS + ("secondary", "tertiary")
+
+def _in(values) -> str:
+    return ", ".join(f"'{v}'" for v in values)
+
+def zoom_filter(z: int) -> str:
+    """
+    Qué calles entran al tile según el zoom (sobre el CTE scored):
+    z<=11 vías principales o nivel Alto; z<=13 además secundarias/terciarias
+    o nivel Medio; desde z14 todas.
+    """
+    if z <= 11:
+        return f"(highway IN ({_in(MAJOR_ROADS)}) OR nivel = 'Alto')"
+    if z <= 13:
+        return f"(highway IN ({_in(MEDIUM_ROADS)}) OR nivel IN ('Alto', 'Medio'))"
+    return "TRUE"
+
+def simplify_tolerance(z: int) -> float:
+    """Tolerancia de simplificación (m, EPSG:3857): medio pixel del tile en ese zoom."""
+    return WORLD_M / (2 ** z) / TILE_EXTENT / 2
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def render_tile(
+    conn,
+    z: int,
+    x: int,
+    y: int,
+    hours: int = 72,
+    tolerance_m: float = 0.0,
+    use_hazard: bool = True,
+    min_mm: float = 0.0,
+    mm_ref: float = 80.0,
+    only_cdmx: bool = False,
+    weighted: bool = False,
+    run_id: Optional[int] = None,
+) -> Optional[bytes]:
+    """
+    Tile MVT (capa 'calles') con las calles con score que tocan el tile z/x/y:
+    filtro por zoom (zoom_filter), geometría presimplificada (calles.geom_sN),
+    simplificación a medio pixel y recorte con ST_AsMVTGeom. Mismos parámetros de score que scoring.score_rows.
+    """
+    where_extra, params, plan = scoring.query_params(
+        conn, hours, tolerance_m, use_hazard, min_mm, mm_ref, None, only_cdmx, None, None, run_id=run_id)
+    # Candidatas por bbox del tile (con margen) sobre el índice GiST de calles.geom
+    where_extra += " AND c.geom && ST_Transform(ST_TileEnvelope(:z, :x, :y, margin => :margin), 4326)"
+    params.update({"z": z, "x": x, "y": y, "margin": TILE_BUFFER / TILE_EXTENT,
+                   "extent": TILE_EXTENT, "buffer": TILE_BUFFER, "simplify": simplify_tolerance(z)})
+
+    # Columna presimplificada de ~1 pixel; ST_Simplify afina al medio pixel
+    geom_col = scoring.geom_column(scoring.zoom_simplify_m(z))
+    sql = text(f"""
+        {scoring.scored_sql(tolerance_m, use_hazard, where_extra, plan, weighted, geom_col)},
+        mvt AS (
+            SELECT
+                nombre, alcaldia, highway, p72_mm, peak_mm_h, hazard, score, nivel,
+                ST_AsMVTGeom(
+                    ST_Simplify(ST_Transform(geom, 3857), :simplify),
+                    ST_TileEnvelope(:z, :x, :y), :extent, :buffer, true
+                ) AS geom
+            FROM scored
+            WHERE {zoom_filter(z)}
+        )
+        SELECT ST_AsMVT(mvt, 'calles', :extent, 'geom')
+        FROM mvt
+        WHERE geom IS NOT NULL
+    """)
+    tile = conn.execute(sql, params).scalar()
+    return bytes(tile) if tile is not None else None
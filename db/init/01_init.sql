@@ -1,38 +1,167 @@
 -- Extensiones
 CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- unaccent() es STABLE (depende del diccionario por defecto); esta envoltura fija
+-- el diccionario y es IMMUTABLE para usarse en columnas generadas e índices.
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+  SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$;
 
 -- Calles
 CREATE TABLE IF NOT EXISTS calles (
   id SERIAL PRIMARY KEY,
+  osm_way_id BIGINT,          -- id del way de OSM: llave estable para upserts del loader
   nombre TEXT,
   alcaldia TEXT,
-  geom geometry(MultiLineString, 4326)
+  highway TEXT,               -- clase de vía OSM (primary, residential, ...): filtra tiles por zoom
+  -- Nombre en minúsculas y sin acentos para búsqueda difusa (pg_trgm)
+  nombre_norm TEXT GENERATED ALWAYS AS (lower(f_unaccent(nombre))) STORED,
+  in_cdmx BOOLEAN NOT NULL DEFAULT FALSE,  -- alcaldia/in_cdmx los asigna api/enrich.py tras cargar
+  geom geometry(MultiLineString, 4326),
+  -- Hash de la geometría: el loader salta los ways cuya geometría no cambió
+  geom_hash TEXT GENERATED ALWAYS AS (md5(ST_AsBinary(geom))) STORED,
+  -- Proyección métrica (UTM 14N) para ST_DWithin en metros con índice propio
+  geom_m geometry(MultiLineString, 32614) GENERATED ALWAYS AS (ST_Transform(geom, 32614)) STORED,
+  -- Versiones simplificadas (tolerancia 5/20/80 m, calculada en UTM) para mapas de baja escala
+  geom_s5 geometry(MultiLineString, 4326) GENERATED ALWAYS AS
+    (ST_Multi(ST_Transform(ST_SimplifyPreserveTopology(ST_Transform(geom, 32614), 5), 4326))) STORED,
+  geom_s20 geometry(MultiLineString, 4326) GENERATED ALWAYS AS
+    (ST_Multi(ST_Transform(ST_SimplifyPreserveTopology(ST_Transform(geom, 32614), 20), 4326))) STORED,
+  geom_s80 geometry(MultiLineString, 4326) GENERATED ALWAYS AS
+    (ST_Multi(ST_Transform(ST_SimplifyPreserveTopology(ST_Transform(geom, 32614), 80), 4326))) STORED
 );
+CREATE UNIQUE INDEX IF NOT EXISTS idx_calles_osm_way_id ON calles (osm_way_id);
 CREATE INDEX IF NOT EXISTS idx_calles_geom ON calles USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_calles_geom_m ON calles USING GIST (geom_m);
+CREATE INDEX IF NOT EXISTS idx_calles_alcaldia ON calles (alcaldia);
+CREATE INDEX IF NOT EXISTS idx_calles_in_cdmx ON calles (in_cdmx);
+CREATE INDEX IF NOT EXISTS idx_calles_nombre_trgm ON calles USING GIN (nombre_norm gin_trgm_ops);
+
+-- Rejillas regulares de pronóstico (centroide de la celda (0,0) = minx,miny)
+CREATE TABLE IF NOT EXISTS forecast_grids (
+  id SERIAL PRIMARY KEY,
+  minx DOUBLE PRECISION NOT NULL,
+  miny DOUBLE PRECISION NOT NULL,
+  step_deg DOUBLE PRECISION NOT NULL,
+  nx INT NOT NULL,
+  ny INT NOT NULL,
+  built_at TIMESTAMP,                   -- street_cells calculado
+  UNIQUE (minx, miny, step_deg, nx, ny)
+);
+
+-- Registro de corridas de pronóstico (una sola activa a la vez)
+CREATE TABLE IF NOT EXISTS forecast_runs (
+  id BIGSERIAL PRIMARY KEY,
+  source TEXT NOT NULL,                 -- openmeteo | manual
+  issued_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+  activated_at TIMESTAMP,
+  refreshed_at TIMESTAMP,               -- último recálculo de derivados sin corrida nueva (POST /score/refresh)
+  window_from TIMESTAMP,
+  window_to TIMESTAMP,
+  series_start TIMESTAMP,               -- hora de mm_cum[1] (UTC naive)
+  bbox TEXT,
+  step_deg DOUBLE PRECISION,
+  grid_id INT REFERENCES forecast_grids(id),  -- NULL si las celdas no son una rejilla regular
+  status TEXT NOT NULL DEFAULT 'loading',  -- loading | ready | superseded | failed
+  n_cells INT NOT NULL DEFAULT 0,
+  is_active BOOLEAN NOT NULL DEFAULT FALSE,
+  error TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_forecast_runs_active ON forecast_runs (is_active) WHERE is_active;
 
 -- Pronóstico de precipitación (polígonos/celdas)
 CREATE TABLE IF NOT EXISTS precip_forecast (
   id SERIAL PRIMARY KEY,
+  run_id BIGINT REFERENCES forecast_runs(id),
+  cell_idx INT,               -- iy*nx + ix si la corrida usa forecast_grids
   ts TIMESTAMP NOT NULL,      -- marca de corrida (UTC naive)
-  mm DOUBLE PRECISION NOT NULL DEFAULT 0,
-  geom geometry(Polygon, 4326) NOT NULL
+  mm DOUBLE PRECISION NOT NULL DEFAULT 0,  -- total de la ventana pedida al cargar
+  mm_cum REAL[] NOT NULL,     -- suma prefija horaria: mm_cum[h] = lluvia en las primeras h horas
+  peak_cum REAL[],            -- máximo prefijo horario: peak_cum[h] = mm/h máximo en las primeras h horas
+  geom geometry(Polygon, 4326) NOT NULL,
+  geom_m geometry(Polygon, 32614) GENERATED ALWAYS AS (ST_Transform(geom, 32614)) STORED
 );
 CREATE INDEX IF NOT EXISTS idx_precip_geom ON precip_forecast USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_precip_geom_m ON precip_forecast USING GIST (geom_m);
 CREATE INDEX IF NOT EXISTS idx_precip_ts ON precip_forecast (ts);
+CREATE INDEX IF NOT EXISTS idx_precip_run ON precip_forecast (run_id, cell_idx);
 
 -- Alcaldías (para enriquecer nombres)
 CREATE TABLE IF NOT EXISTS alcaldias (
   id SERIAL PRIMARY KEY,
   nombre TEXT,
-  geom geometry(MultiPolygon, 4326)
+  nombre_norm TEXT GENERATED ALWAYS AS (lower(f_unaccent(nombre))) STORED,
+  geom geometry(MultiPolygon, 4326),
+  geom_m geometry(MultiPolygon, 32614) GENERATED ALWAYS AS (ST_Transform(geom, 32614)) STORED
 );
 CREATE INDEX IF NOT EXISTS idx_alcaldias_geom ON alcaldias USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_alcaldias_geom_m ON alcaldias USING GIST (geom_m);
+
+-- Alcaldías subdivididas (ST_Subdivide, pocos vértices por pedazo): bbox ajustado para
+-- el filtro GiST y prueba exacta barata. La mantiene api/enrich.refresh_alcaldias_sub.
+CREATE TABLE IF NOT EXISTS alcaldias_sub (
+  id SERIAL PRIMARY KEY,
+  alcaldia_id INT NOT NULL REFERENCES alcaldias(id) ON DELETE CASCADE,
+  nombre TEXT,
+  geom geometry(Polygon, 4326) NOT NULL,
+  geom_m geometry(Polygon, 32614) GENERATED ALWAYS AS (ST_Transform(geom, 32614)) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_alcaldias_sub_geom ON alcaldias_sub USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_alcaldias_sub_geom_m ON alcaldias_sub USING GIST (geom_m);
 
 -- Polígonos de riesgo (opcional)
 CREATE TABLE IF NOT EXISTS flood_polygons (
   id SERIAL PRIMARY KEY,
   fuente TEXT,
   fecha DATE,
-  geom geometry(Polygon, 4326)
+  geom geometry(Polygon, 4326),
+  geom_m geometry(Polygon, 32614) GENERATED ALWAYS AS (ST_Transform(geom, 32614)) STORED
 );
 CREATE INDEX IF NOT EXISTS idx_flood_geom ON flood_polygons USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_flood_geom_m ON flood_polygons USING GIST (geom_m);
+
+-- Polígonos de riesgo subdivididos (igual que alcaldias_sub); los usan hazard y scoring
+CREATE TABLE IF NOT EXISTS flood_polygons_sub (
+  id SERIAL PRIMARY KEY,
+  polygon_id INT NOT NULL REFERENCES flood_polygons(id) ON DELETE CASCADE,
+  geom geometry(Polygon, 4326) NOT NULL,
+  geom_m geometry(Polygon, 32614) GENERATED ALWAYS AS (ST_Transform(geom, 32614)) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_flood_sub_geom ON flood_polygons_sub USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_flood_sub_geom_m ON flood_polygons_sub USING GIST (geom_m);
+CREATE INDEX IF NOT EXISTS idx_flood_sub_polygon ON flood_polygons_sub (polygon_id);
+
+-- Scores materializados por corrida y tolerancia (se llenan tras cada ingesta).
+-- Solo las ventanas estándar (scoring.SCORE_WINDOWS) como escalares; las series
+-- completas viven una vez por celda en precip_forecast
+CREATE TABLE IF NOT EXISTS street_scores (
+  run_id BIGINT NOT NULL REFERENCES forecast_runs(id),
+  tol_m REAL NOT NULL,
+  calle_id INT NOT NULL REFERENCES calles(id) ON DELETE CASCADE,
+  mm_6h REAL, mm_24h REAL, mm_72h REAL, mm_168h REAL,          -- lluvia de las celdas que toca la calle
+  mmw_6h REAL, mmw_24h REAL, mmw_72h REAL, mmw_168h REAL,      -- igual, ponderada por la fracción de la calle en cada celda
+  peak_6h REAL, peak_24h REAL, peak_72h REAL, peak_168h REAL,  -- pico horario (mm/h) de esas celdas
+  PRIMARY KEY (run_id, tol_m, calle_id)
+);
+
+-- Calle -> celdas de una rejilla regular (se calcula una vez por rejilla)
+CREATE TABLE IF NOT EXISTS street_cells (
+  grid_id INT NOT NULL REFERENCES forecast_grids(id) ON DELETE CASCADE,
+  calle_id INT NOT NULL REFERENCES calles(id) ON DELETE CASCADE,
+  cell_idx INT NOT NULL,
+  dist_m REAL NOT NULL,       -- 0 si la calle toca la celda
+  overlap_frac REAL NOT NULL, -- fracción de la longitud de la calle dentro de la celda
+  PRIMARY KEY (grid_id, calle_id, cell_idx)
+);
+
+-- Hazard precalculado por calle y tolerancia (solo filas con hazard; se refresca al cargar flood_polygons)
+CREATE TABLE IF NOT EXISTS street_hazard (
+  calle_id INT NOT NULL REFERENCES calles(id) ON DELETE CASCADE,
+  tol_m REAL NOT NULL,
+  hazard REAL NOT NULL DEFAULT 1,
+  frac REAL NOT NULL DEFAULT 0,  -- fracción de la longitud de la calle dentro de polígonos
+  PRIMARY KEY (calle_id, tol_m)
+);
@@ -0,0 +1,117 @@
+# tests/test_db_routing.py
+# Ruteo de lecturas/escrituras de api/db.py (primario + réplicas de lectura).
+# Las pruebas con servidor usan dos bases Postgres reales (una hace de réplica):
+#   TEST_POSTGRES_URL=postgresql+psycopg://.../flooddb \
+#   TEST_POSTGRES_REPLICA_URL=postgresql+psycopg://...:5433/flooddb python -m pytest -q tests
+# Sin esas variables solo corren las pruebas que no se conectan.
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("psycopg")
+from sqlalchemy import text
+
+PRIMARY = "postgresql+psycopg://u:p@primary:5432/flooddb"
+REPLICAS = ["postgresql+psycopg://u:p@replica-a:5432/flooddb", "postgresql+psycopg://u:p@replica-b:5432/flooddb"]
+
+@pytest.fixture
+def load_db(monkeypatch):
+    """Importa api.db de cero con las URLs dadas; restaura el módulo original al final."""
+    original = sys.modules.get("api.db")
+    loaded = []
+
+    def load(primary, reads=()):
+        monkeypatch.setenv("POSTGRES_URL", primary)
+        monkeypatch.setenv("POSTGRES_READ_URLS", ",".join(reads))
+        sys.modules.pop("api.db", None)
+        db = importlib.import_module("api.db")
+        loaded.append(db)
+        return db
+
+    yield load
+    for db in loaded:
+        db.engine.dispose()
+        for e in db.read_engines:
+            e.dispose()
+    if original is not None:
+        sys.modules["api.db"] = original
+    else:
+        sys.modules.pop("api.db", None)
+
+def hosts(engines):
+    return [e.url.host for e in engines]
+
+# ======= Sin servidor: armado de engines y round-robin =======
+def test_reads_go_to_replicas(load_db):
+    db = load_db(PRIMARY, REPLICAS)
+    assert db.engine.url.host == "primary"
+    assert hosts(db.read_engines) == ["replica-a", "replica-b"]
+    assert hosts(e.sync_engine for e in db.async_read_engines) == ["replica-a", "replica-b"]
+    names = [m.name for m in db.metrics]
+    assert names == ["write", "read[0]", "read[1]", "read_async[0]", "read_async[1]"]
+
+def test_without_replicas_reads_use_primary(load_db):
+    db = load_db(PRIMARY)
+    assert db.read_engines == [db.engine]
+    assert hosts(e.sync_engine for e in db.async_read_engines) == ["primary"]
+    assert [m.name for m in db.metrics] == ["write", "read_async[0]"]
+
+def test_read_replica_round_robin(load_db):
+    db = load_db(PRIMARY, REPLICAS)
+    picks = [db.read_replica() for _ in range(6)]
+    assert sorted(set(picks)) == [0, 1]
+    assert all(a != b for a, b in zip(picks, picks[1:]))
+
+# ======= Con dos bases reales =======
+needs_servers = pytest.mark.skipif(
+    not (os.getenv("TEST_POSTGRES_URL") and os.getenv("TEST_POSTGRES_REPLICA_URL")),
+    reason="requiere TEST_POSTGRES_URL y TEST_POSTGRES_REPLICA_URL",
+)
+
+IDENTITY = text("SELECT current_database() || ':' || inet_server_port()")
+
+@needs_servers
+def test_connect_by_intent(load_db):
+    primary, replica = os.environ["TEST_POSTGRES_URL"], os.environ["TEST_POSTGRES_REPLICA_URL"]
+    db = load_db(primary, [replica])
+    with db.connect("write") as conn:
+        w = conn.execute(IDENTITY).scalar()
+    with db.connect("read") as conn:
+        r = conn.execute(IDENTITY).scalar()
+    assert w != r
+    with db.engine.connect() as conn:
+        assert conn.execute(IDENTITY).scalar() == w
+
+    stats = {s["name"]: s for s in db.pool_stats()}
+    assert stats["write"]["query_latency"]["count"] >= 2
+    assert stats["read[0]"]["query_latency"]["count"] >= 1
+    assert stats["read[0]"]["checkout_wait"]["count"] >= 1
+
+@needs_servers
+def test_run_read_pinned_replica(load_db):
+    primary, replica = os.environ["TEST_POSTGRES_URL"], os.environ["TEST_POSTGRES_REPLICA_URL"]
+    # Dos engines de lectura (réplica y primario) para distinguir a cuál fue cada lectura
+    db = load_db(primary, [replica, primary])
+
+    def identity(conn):
+        return conn.execute(IDENTITY).scalar()
+
+    async def go():
+        try:
+            spread = {await db.run_read(identity) for _ in range(4)}
+            i = db.read_replica()
+            pinned = {await db.run_read(identity, replica=i) for _ in range(4)}
+            async with db.read_connect(i) as conn:
+                same = (await conn.execute(IDENTITY)).scalar()
+            return spread, pinned, same
+        finally:
+            for e in db.async_read_engines:
+                await e.dispose()
+
+    spread, pinned, same = asyncio.run(go())
+    assert len(spread) == 2  # round-robin entre ambas
+    assert len(pinned) == 1 and same in pinned
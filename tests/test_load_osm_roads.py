@@ -0,0 +1,93 @@
+# tests/test_load_osm_roads.py
+# Pruebas del parser incremental y del armado de filas de tools/load_osm_roads.py (sin red ni base).
+# Correr desde la raíz del repo (requiere pytest): python -m pytest -q tests
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("sqlalchemy")
+from tools import load_osm_roads as osm
+
+SAMPLE = Path(__file__).resolve().parents[1] / "data" / "overpass_sample.json"
+
+def chunked(data: bytes, size: int):
+    """Bloques de `size` bytes, con vacíos intercalados (como iter_content)."""
+    for i in range(0, len(data), size):
+        yield b""
+        yield data[i:i + size]
+
+# ======= iter_elements =======
+@pytest.mark.parametrize("size", [1, 7, 64, 1 << 20])
+def test_iter_elements_matches_json_load(size):
+    data = SAMPLE.read_bytes()
+    assert list(osm.iter_elements(chunked(data, size))) == json.loads(data)["elements"]
+
+def test_iter_elements_utf8_split_across_chunks():
+    data = json.dumps({"elements": [{"type": "way", "id": 1, "tags": {"name": "Calzada de Tlalpan ñ"}}]},
+                      ensure_ascii=False).encode()
+    els = list(osm.iter_elements(chunked(data, 1)))
+    assert els[0]["tags"]["name"] == "Calzada de Tlalpan ñ"
+
+def test_iter_elements_remark_error():
+    data = b'{"elements": [{"type": "way", "id": 1}], "remark": "runtime error: Query timed out"}'
+    with pytest.raises(RuntimeError, match="runtime error"):
+        list(osm.iter_elements(chunked(data, 5)))
+
+def test_iter_elements_truncated():
+    data = SAMPLE.read_bytes()[:-40]
+    with pytest.raises(ValueError):
+        list(osm.iter_elements(chunked(data, 16)))
+
+def test_iter_elements_without_elements():
+    with pytest.raises(ValueError, match="elements"):
+        list(osm.iter_elements(iter([b'{"remark": "nada"}'])))
+
+# ======= way_row =======
+def test_way_row_sample():
+    rows = [osm.way_row(el) for el in osm.iter_elements(chunked(SAMPLE.read_bytes(), 64))]
+    assert rows == [
+        (24317010, "Avenida 5 de Mayo", "primary",
+         "LINESTRING(-99.134 19.432,-99.133 19.4325,-99.132 19.433)"),
+        (24317011, "Calle Regina", "residential", "LINESTRING(-99.14 19.43,-99.139 19.431)"),
+        (24317012, "(sin nombre)", "service", "LINESTRING(-99.06 19.35,-99.0595 19.3505,-99.059 19.351)"),
+    ]
+
+@pytest.mark.parametrize("el", [
+    {"type": "node", "id": 1, "lat": 19.4, "lon": -99.1},
+    {"type": "relation", "id": 2, "members": []},
+    {"type": "way", "id": 3, "geometry": [{"lat": 19.4, "lon": -99.1}], "tags": {"highway": "service"}},
+    {"type": "way", "id": 4, "tags": {"highway": "service"}},
+    {"type": "way", "id": 5, "geometry": None},
+])
+def test_way_row_skips(el):
+    assert osm.way_row(el) is None
+
+def test_way_row_without_tags():
+    el = {"type": "way", "id": 6, "geometry": [{"lat": 19.4, "lon": -99.1}, {"lat": 19.5, "lon": -99.2}], "tags": None}
+    assert osm.way_row(el) == (6, "(sin nombre)", None, "LINESTRING(-99.1 19.4,-99.2 19.5)")
+
+# ======= tiles =======
+@pytest.mark.parametrize("bbox, step", [
+    (osm.BBOX, osm.TILE_DEG),
+    (osm.BBOX, 0.07),            # no divide al bbox: la última fila/columna queda recortada
+    ((19.0, -99.0, 19.1, -98.9), 0.2),  # un solo tile más grande que el bbox
+])
+def test_tiles_cover_bbox(bbox, step):
+    s, w, n, e = bbox
+    out = osm.tiles(bbox, step)
+    names = [name for name, _ in out]
+    assert len(set(names)) == len(names)
+    rows = sorted({(ts, tn) for _, (ts, _, tn, _) in out})
+    cols = sorted({(tw, te) for _, (_, tw, _, te) in out})
+    # Filas y columnas contiguas de borde a borde, sin huecos ni traslapes
+    assert rows[0][0] == round(s, 6) and rows[-1][1] == round(n, 6)
+    assert cols[0][0] == round(w, 6) and cols[-1][1] == round(e, 6)
+    assert all(a[1] == b[0] for a, b in zip(rows, rows[1:]))
+    assert all(a[1] == b[0] for a, b in zip(cols, cols[1:]))
+    # Cada (fila, columna) aparece exactamente una vez
+    assert sorted((ts, tw) for _, (ts, tw, _, _) in out) == sorted((r[0], c[0]) for r in rows for c in cols)
+    for name, tb in out:
+        assert name == ",".join(str(x) for x in tb)
+        assert tb[0] < tb[2] and tb[1] < tb[3]
@@ -0,0 +1,136 @@
+# tests/test_openmeteo.py
+# Pruebas de openmeteo.fetch_grid contra un stub HTTP local (sin red).
+# Correr desde la raíz del repo (requiere pytest): python -m pytest -q tests
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from api import openmeteo
+
+# ======= Stub de Open-Meteo =======
+def forecast_for(lat: str, lon: str) -> dict:
+    """Respuesta de una coordenada; la lluvia codifica la coordenada para verificar el mapeo."""
+    return {
+        "latitude": float(lat),
+        "longitude": float(lon),
+        "hourly": {"time": ["2024-01-01T00:00"], "precipitation": [float(lat) + float(lon)]},
+    }
+
+class Stub:
+    """Servidor en 127.0.0.1:<puerto libre>; `respond(n, lats, lons)` decide (status, cuerpo, espera_s)."""
+    def __init__(self):
+        self.calls = []
+        self.respond = self.ok
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                q = parse_qs(urlparse(self.path).query)
+                lats, lons = q["latitude"][0].split(","), q["longitude"][0].split(",")
+                stub.calls.append((lats, lons))
+                status, body, wait_s = stub.respond(len(stub.calls), lats, lons)
+                if wait_s:
+                    time.sleep(wait_s)
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # el cliente ya se rindió (prueba de presupuesto)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/forecast"
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    @staticmethod
+    def ok(n, lats, lons):
+        # Como Open-Meteo: una coordenada -> objeto; varias -> lista en el mismo orden
+        items = [forecast_for(la, lo) for la, lo in zip(lats, lons)]
+        return 200, items[0] if len(items) == 1 else items, 0
+
+@pytest.fixture
+def stub():
+    s = Stub()
+    s._thread.start()
+    yield s
+    s.server.shutdown()
+    s.server.server_close()
+
+POINTS = [(19.4, -99.2), (19.4, -99.1), (19.5, -99.2), (19.5, -99.1), (19.6, -99.2)]
+
+def fetch(stub, points=POINTS, **kw):
+    opts = dict(base_url=stub.url, concurrency=2, timeout_s=2, cell_budget_s=5, retries=3, backoff_s=0)
+    opts.update(kw)
+    return openmeteo.fetch_grid(points, **opts)
+
+def precip(result, pt):
+    return result[pt]["hourly"]["precipitation"][0]
+
+# ======= Mapeo de lotes a celdas =======
+def test_single_coordinate_object(stub):
+    res, stats = fetch(stub, batch_size=1)
+    assert stats["http_calls"] == len(POINTS) == len(stub.calls)
+    assert stats["ok"] == len(POINTS) and stats["failed"] == 0
+    for pt in POINTS:
+        assert precip(res, pt) == pytest.approx(pt[0] + pt[1])
+
+def test_multi_coordinate_list_maps_back_by_position(stub):
+    res, stats = fetch(stub, batch_size=2)
+    assert stats["http_calls"] == 3 == len(stub.calls)
+    assert sorted(len(lats) for lats, _ in stub.calls) == [1, 2, 2]
+    assert stats["ok"] == len(POINTS) and stats["failed"] == 0
+    for pt in POINTS:
+        assert res[pt]["latitude"] == pt[0] and res[pt]["longitude"] == pt[1]
+        assert precip(res, pt) == pytest.approx(pt[0] + pt[1])
+
+# ======= Reintentos =======
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retries_transient_status(stub, status):
+    stub.respond = lambda n, lats, lons: (status, {"error": True}, 0) if n <= 2 else Stub.ok(n, lats, lons)
+    res, stats = fetch(stub, batch_size=len(POINTS))
+    assert len(stub.calls) == 3
+    assert stats["ok"] == len(POINTS) and stats["failed"] == 0
+
+def test_gives_up_after_retries(stub):
+    stub.respond = lambda n, lats, lons: (503, {"error": True}, 0)
+    res, stats = fetch(stub, batch_size=len(POINTS), retries=2)
+    assert len(stub.calls) == 3
+    assert res == {} and stats["failed"] == len(POINTS)
+
+def test_client_error_not_retried(stub):
+    stub.respond = lambda n, lats, lons: (400, {"error": True, "reason": "bad"}, 0)
+    res, stats = fetch(stub, batch_size=len(POINTS))
+    assert len(stub.calls) == 1
+    assert stats["failed"] == len(POINTS)
+
+# ======= Presupuesto por lote =======
+def test_budget_cuts_off_slow_batch(stub):
+    stub.respond = lambda n, lats, lons: (200, Stub.ok(n, lats, lons)[1], 1.0)
+    t0 = time.monotonic()
+    res, stats = fetch(stub, batch_size=len(POINTS), timeout_s=5, cell_budget_s=0.3, retries=5)
+    assert time.monotonic() - t0 < 0.9
+    assert len(stub.calls) == 1  # el presupuesto se agotó en el primer intento
+    assert res == {} and stats["failed"] == len(POINTS)
+
+# ======= Respuesta inconsistente =======
+def test_result_count_mismatch_counts_as_failed(stub):
+    def short(n, lats, lons):
+        status, body, _ = Stub.ok(n, lats, lons)
+        return status, body[:-1] if len(lats) > 1 else body, 0
+
+    stub.respond = short
+    res, stats = fetch(stub, batch_size=2)
+    # Los dos lotes de 2 vienen cortos; el lote de 1 se mapea bien
+    assert stats["failed"] == 4 and stats["ok"] == 1
+    assert list(res) == [POINTS[-1]]